@@ -1,10 +1,27 @@
 from django.contrib import admin
-from .models import Trip, Event, Participant, Expense, Task
+from .models import Trip, Event, Participant, Expense, Task, DestinationResolution, WeatherSummary
+from .destinations import warm_destinations
+
+@admin.action(description="Resolve destinations of selected trips")
+def resolve_trip_destinations(modeladmin, request, queryset):
+    resolved, failed = warm_destinations(queryset.values_list('destination', flat=True))
+    modeladmin.message_user(request, f"Resolved {len(resolved)} destination(s), {len(failed)} failed.")
+
+class TripAdmin(admin.ModelAdmin):
+    actions = [resolve_trip_destinations]
+
+class DestinationResolutionAdmin(admin.ModelAdmin):
+    list_display = ['destination_key', 'country_code', 'lat', 'lon', 'resolved_at']
+    search_fields = ['destination_key']
+
+class WeatherSummaryAdmin(admin.ModelAdmin):
+    list_display = ['key', 'created_at', 'last_used_at']
 
 # Register your models here.
-admin.site.register(Trip)
+admin.site.register(Trip, TripAdmin)
 admin.site.register(Event)
 admin.site.register(Participant)
 admin.site.register(Expense)
 admin.site.register(Task)
-
+admin.site.register(DestinationResolution, DestinationResolutionAdmin)
+admin.site.register(WeatherSummary, WeatherSummaryAdmin)
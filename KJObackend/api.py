@@ -1,29 +1,63 @@
 
 # Dependencies from other files
 from .models import Trip, Event, Participant, Expense, Task
-from .serializers import TripSerializer, EventSerializer, ParticipantSerializer, ParticipantCreateSerializer, ExpenseSerializer, TaskSerializer
-from .external_apis import get_ticketmaster_events, get_country_code, get_coordinates, get_weather_forecast, interpret_weather_forecast
+from .serializers import TripSerializer, TripSummarySerializer, EventSerializer, ParticipantSerializer, ParticipantCreateSerializer, ExpenseSerializer, TaskSerializer, DestinationResolutionSerializer
+from .pagination import KeysetPagination
+from .snapshots import schedule_snapshot, snapshot_response
+from .destinations import resolve_destinations
+from .external_info import abuild_external_info, astream_external_info, missing_steps, filter_events
+from .caching import cache_stats
+from .http_client import host_stats
+from .singleflight import coalescing_stats
+from .breaker import breakers
+from . import metrics, ratelimit
 
 # Django imports
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import authenticate, get_user_model
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
 
 # REST imports
 from rest_framework import generics
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import BasePermission, IsAuthenticated, IsAdminUser
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.authtoken.models import Token
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 # Misc imports
+from asgiref.sync import sync_to_async
 from datetime import date
+import hmac
+import json
+import logging
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+def sparse(queryset, serializer_class, request, **kwargs):
+    # Loads only the columns and relations read by the fields requested with ?fields= / ?expand=
+    return serializer_class.setup_eager_loading(queryset, serializer_class.requested_fields(request), **kwargs)
 
 class TripListCreateAPI(generics.ListCreateAPIView):
     serializer_class   = TripSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class   = KeysetPagination
+    keyset_ordering    = ('start_date', 'id')
+
+    def summary_view(self):
+        # ?view=summary lists trip cards (counts and totals) instead of every nested row
+        view = self.request.query_params.get('view', 'full')
+        if view not in ('full', 'summary'):
+            raise ValidationError({'view': "Expected 'full' or 'summary'."})
+        return self.request.method == 'GET' and view == 'summary'
+
+    def get_serializer_class(self):
+        return TripSummarySerializer if self.summary_view() else TripSerializer
 
     def get_queryset(self):
         relevant_trips = Trip.objects.filter(participants=self.request.user)
@@ -36,7 +70,10 @@ class TripListCreateAPI(generics.ListCreateAPIView):
         elif time_flag == "past":
             relevant_trips = relevant_trips.filter(end_date__lt=today)
 
-        return relevant_trips.order_by('start_date')
+        relevant_trips = relevant_trips.order_by('start_date')
+        if self.summary_view():
+            return sparse(relevant_trips, TripSummarySerializer, self.request, user=self.request.user, columns=self.keyset_ordering)
+        return sparse(relevant_trips, TripSerializer, self.request, columns=self.keyset_ordering)
 
     def perform_create(self, serializer):
         trip = serializer.save(owner=self.request.user)
@@ -44,6 +81,7 @@ class TripListCreateAPI(generics.ListCreateAPIView):
             user=self.request.user,
             trip=trip,
         )
+        schedule_snapshot(trip.id)
 
 class TripDetailAPI(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = TripSerializer
@@ -51,15 +89,26 @@ class TripDetailAPI(generics.RetrieveUpdateDestroyAPIView):
 
     # to override default due to naming
     def get_object(self):
-        return get_object_or_404(Trip, id=self.kwargs["trip_id"])
+        return get_object_or_404(sparse(Trip.objects.all(), TripSerializer, self.request), id=self.kwargs["trip_id"])
+
+    def perform_update(self, serializer):
+        trip = serializer.instance
+        before = (trip.destination, trip.start_date, trip.end_date)
+        trip = serializer.save()
+
+        # External info depends on where and when the trip is
+        if (trip.destination, trip.start_date, trip.end_date) != before:
+            schedule_snapshot(trip.id)
 
 class EventListCreateAPI(generics.ListCreateAPIView):
     serializer_class = EventSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('date', 'id')
 
     def get_queryset(self):
         trip_id = self.kwargs['trip_id']
-        return Event.objects.filter(trip_id=trip_id)
+        return sparse(Event.objects.filter(trip_id=trip_id), EventSerializer, self.request, columns=self.keyset_ordering)
 
     def perform_create(self, serializer):
         trip = get_object_or_404(Trip, id=self.kwargs['trip_id'])
@@ -77,11 +126,13 @@ class EventDetailAPI(generics.RetrieveUpdateDestroyAPIView):
         trip = get_object_or_404(Trip, id=self.kwargs["trip_id"])
         if not trip.participants.filter(id=self.request.user.id).exists():
             raise PermissionDenied("Only participants can modify events")
-        return get_object_or_404(Event, id=self.kwargs["event_id"], trip=trip)
+        return get_object_or_404(sparse(Event.objects.all(), EventSerializer, self.request), id=self.kwargs["event_id"], trip=trip)
 
 class ParticipantListCreateAPI(generics.ListCreateAPIView):
     serializer_class = ParticipantSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
 
     def get_serializer_class(self):
         return ParticipantCreateSerializer if self.request.method == 'POST' else ParticipantSerializer
@@ -90,7 +141,7 @@ class ParticipantListCreateAPI(generics.ListCreateAPIView):
         trip = get_object_or_404(Trip, id=self.kwargs['trip_id'])
         if not trip.participants.filter(id=self.request.user.id).exists():
             raise PermissionDenied("Only participants can view other participants")
-        return Participant.objects.filter(trip=trip)
+        return sparse(Participant.objects.filter(trip=trip), ParticipantSerializer, self.request, columns=self.keyset_ordering)
 
     def perform_create(self, serializer):
         trip = get_object_or_404(Trip, id=self.kwargs['trip_id'])
@@ -120,7 +171,7 @@ class ParticipantDetailAPI(generics.RetrieveUpdateDestroyAPIView):
         trip = get_object_or_404(Trip, id=self.kwargs["trip_id"])
         if not trip.participants.filter(id=self.request.user.id).exists():
             raise PermissionDenied("Only participants can see or delete other participants")
-        return get_object_or_404(Participant, id=self.kwargs["participant_id"], trip=trip)
+        return get_object_or_404(sparse(Participant.objects.all(), ParticipantSerializer, self.request), id=self.kwargs["participant_id"], trip=trip)
     
     # Override to prevent participants from being edited
     def put(self, request, *args, **kwargs):
@@ -132,6 +183,8 @@ class ParticipantDetailAPI(generics.RetrieveUpdateDestroyAPIView):
 class ExpenseListCreateAPI(generics.ListCreateAPIView):
     serializer_class = ExpenseSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
     
     def get_queryset(self):
         trip = get_object_or_404(Trip, id=self.kwargs['trip_id'])
@@ -139,7 +192,7 @@ class ExpenseListCreateAPI(generics.ListCreateAPIView):
         if not trip.participants.filter(id=self.request.user.id).exists():
             raise PermissionDenied("Only participants can view expenses")
             
-        return Expense.objects.filter(trip=trip)
+        return sparse(Expense.objects.filter(trip=trip), ExpenseSerializer, self.request, columns=self.keyset_ordering)
     
     def perform_create(self, serializer):
         trip = get_object_or_404(Trip, id=self.kwargs['trip_id'])
@@ -158,17 +211,19 @@ class ExpenseDetailAPI(generics.RetrieveUpdateDestroyAPIView):
         trip = get_object_or_404(Trip, id=self.kwargs["trip_id"])
         if not trip.participants.filter(id=self.request.user.id).exists():
             raise PermissionDenied("Only participants can modify expenses")
-        return get_object_or_404(Expense, id=self.kwargs["expense_id"], trip=trip)
+        return get_object_or_404(sparse(Expense.objects.all(), ExpenseSerializer, self.request), id=self.kwargs["expense_id"], trip=trip)
     
 class TaskListCreateAPI(generics.ListCreateAPIView):
     serializer_class   = TaskSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class   = KeysetPagination
+    keyset_ordering    = ('id',)
 
     def get_queryset(self):
         trip = get_object_or_404(Trip, id=self.kwargs['trip_id'])
         if not trip.participants.filter(id=self.request.user.id).exists():
             raise PermissionDenied("Only participants can view tasks")
-        return Task.objects.filter(trip=trip)
+        return sparse(Task.objects.filter(trip=trip), TaskSerializer, self.request, columns=self.keyset_ordering)
 
     def perform_create(self, serializer):
         trip = get_object_or_404(Trip, id=self.kwargs['trip_id'])
@@ -192,7 +247,7 @@ class TaskDetailAPI(generics.RetrieveUpdateDestroyAPIView):
         trip = get_object_or_404(Trip, id=self.kwargs["trip_id"])
         if not trip.participants.filter(id=self.request.user.id).exists():
             raise PermissionDenied("Only participants can modify tasks")
-        return get_object_or_404(Task, id=self.kwargs["task_id"], trip=trip)
+        return get_object_or_404(sparse(Task.objects.all(), TaskSerializer, self.request), id=self.kwargs["task_id"], trip=trip)
 
 class LoginView(APIView):
     permission_classes = []
@@ -207,26 +262,146 @@ class LoginView(APIView):
         token, _ = Token.objects.get_or_create(user=user)
         return Response({'token': token.key, 'user_id': user.id})
 
+def event_filters(query_params):
+    # ?day=YYYY-MM-DD and ?category=Music narrow down the events of the external info endpoints
+    day = query_params.get('day')
+    if day is not None:
+        try:
+            date.fromisoformat(day)
+        except ValueError:
+            raise ValidationError({'day': 'Expected a date as YYYY-MM-DD.'})
+    return {'day': day, 'category': query_params.get('category')}
+
 class ExternalInfoAPI(APIView):
     def get(self, request, trip_id):
         trip = Trip.objects.get(pk=trip_id)
-        city_name = trip.destination
-        country_code = get_country_code(city_name)
+        response_data = snapshot_response(trip)
+        filters = event_filters(request.query_params)
+        if any(filters.values()) and response_data.get('status') == 'ready':
+            response_data['events'] = filter_events(response_data['events'], **filters)
+        logger.info('external info', extra={'trip_id': trip.id, 'status': response_data.get('status'), 'payload': response_data})
+        return Response(response_data)
+
+async def authenticate_async(request):
+    # DRF token check for the plain async views; returns an error response, or None if authenticated
+    try:
+        user_auth = await sync_to_async(TokenAuthentication().authenticate)(request)
+    except AuthenticationFailed as error:
+        return JsonResponse({'detail': str(error.detail)}, status=401)
+    if user_auth is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    return None
+
+class ExternalInfoLiveAPI(View):
+    # Native async view (no DRF): computes the external info now instead of serving the snapshot.
+    # Under ASGI the upstream calls are awaited, so a worker isn't tied up per request.
+    async def get(self, request, trip_id):
+        error = await authenticate_async(request)
+        if error:
+            return error
+
+        trip = await Trip.objects.filter(pk=trip_id).afirst()
+        if trip is None:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
 
-        if not country_code:
-            return Response({
-                'events': [] #something to tell the frontend that we found no location, so no weather and no events
-            })
+        try:
+            filters = event_filters(request.GET)
+        except ValidationError as error:
+            return JsonResponse(error.detail, status=400)
+
+        response_data = await abuild_external_info(trip)
+        if any(filters.values()) and 'events' in response_data:
+            response_data['events'] = filter_events(response_data['events'], **filters)
+        return JsonResponse(response_data)
+
+class ExternalInfoStreamAPI(View):
+    # Same as ExternalInfoLiveAPI, but sends every section as a server-sent event as soon as it is ready
+    sections = {
+        'location': 'location',
+        'weather_forecast': 'weather',
+        'events': 'events',
+        'weather_interpretation': 'summary',
+    }
+
+    async def get(self, request, trip_id):
+        error = await authenticate_async(request)
+        if error:
+            return error
+
+        trip = await Trip.objects.filter(pk=trip_id).afirst()
+        if trip is None:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
 
-        lat, lon = map(float, get_coordinates(city_name, country_code))
+        try:
+            filters = event_filters(request.GET)
+        except ValidationError as error:
+            return JsonResponse(error.detail, status=400)
+
+        response = StreamingHttpResponse(self.stream(trip, filters), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # don't let a proxy hold the events back
+        return response
+
+    async def stream(self, trip, filters):
+        results = {}
+        timings = {}
+        async for name, value, elapsed_ms in astream_external_info(trip):
+            results[name] = value
+            timings[name] = elapsed_ms
+            if name == 'location':
+                value = {'country_code': value.country_code, 'lat': value.lat, 'lon': value.lon} if value else None
+            elif name == 'events' and any(filters.values()):
+                value = filter_events(value, **filters)
+            yield self.event(self.sections[name], value)
+
+        yield self.event('done', {'timings': timings, 'missing': missing_steps(results)})
+
+    @staticmethod
+    def event(name, data):
+        return f"event: {name}\ndata: {json.dumps(data, default=str)}\n\n"
+
+class DestinationResolveAPI(APIView):
+    permission_classes = [IsAuthenticated]
+    max_destinations = 500
 
-        weather_forecast = get_weather_forecast(lat, lon)
-        events = get_ticketmaster_events(city_name, country_code, trip.start_date, trip.end_date)
-        weather_interpretation = interpret_weather_forecast(weather_forecast)
-        
-        response_data = {
-            'events': events,
-            'weather_interpretation': weather_interpretation
-        }
-        print(response_data)
-        return Response(response_data)
\ No newline at end of file
+    def post(self, request):
+        names = request.data.get('destinations')
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise ValidationError({'destinations': 'A list of destination names is required.'})
+        if len(names) > self.max_destinations:
+            raise ValidationError({'destinations': f'At most {self.max_destinations} destinations per request.'})
+
+        # Geocoding is rate limited, so only a few new destinations are looked up while the client
+        # waits; the rest are resolved in the background and come back resolved on a later request
+        resolutions = resolve_destinations(names, max_new=settings.DESTINATION_RESOLVE_INLINE)
+        return Response({
+            name: DestinationResolutionSerializer(resolution).data if resolution else None
+            for name, resolution in resolutions.items()
+        })
+
+class StatsAPI(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'caches': {name: stats.snapshot() for name, stats in cache_stats.items()},
+            'hosts': {host: stats.snapshot() for host, stats in host_stats.items()},
+            'coalescing': coalescing_stats.snapshot(),
+            'breakers': {name: breaker.snapshot() for name, breaker in breakers.items()},
+            'rate_limits': ratelimit.snapshot(),
+        })
+
+
+class HasMetricsToken(BasePermission):
+    def has_permission(self, request, view):
+        expected = f"Bearer {settings.METRICS_TOKEN}".encode()
+        return hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected)
+
+
+class MetricsAPI(APIView):
+    # Prometheus text format; needs "Authorization: Bearer <METRICS_TOKEN>" when that is set, an admin otherwise
+    def get_permissions(self):
+        return [HasMetricsToken()] if settings.METRICS_TOKEN else [IsAdminUser()]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
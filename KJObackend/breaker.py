@@ -0,0 +1,142 @@
+# KJObackend/breaker.py
+#
+# One circuit breaker per upstream. It opens when too many recent calls failed or
+# were too slow, so callers fail fast (and fall back to cached data) instead of
+# tying up workers. After BREAKER_OPEN_SECONDS one probe call is let through
+# (half-open): success closes the breaker again, failure re-opens it.
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import metrics
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name):
+        self.name = name
+        self.state = self.CLOSED
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=settings.BREAKER_WINDOW)  # True for each failed or slow call
+        self._opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+
+    def _reject(self):
+        self.rejected += 1
+        return UpstreamUnavailable(f"{self.name} is unavailable (circuit open)")
+
+    def check(self):
+        # Fails fast while calls would be rejected, without taking the half-open probe slot
+        with self._lock:
+            waiting = self.state == self.OPEN and time.monotonic() - self._opened_at < settings.BREAKER_OPEN_SECONDS
+            if not (waiting or (self.state == self.HALF_OPEN and self._probing)):
+                return
+            error = self._reject()
+        raise error
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= settings.BREAKER_OPEN_SECONDS:
+                self.state = self.HALF_OPEN
+                self._probing = False
+
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+
+            error = self._reject()
+        raise error
+
+    @contextmanager
+    def call(self):
+        # before_call() for one call made in the block, which records its outcome through the
+        # yielded _Call. Leaving the block any other way (an unexpected error, cancellation)
+        # counts as a failure, so a half-open probe always gets an answer.
+        self.before_call()
+        call = _Call(self)
+        started = time.monotonic()
+        try:
+            yield call
+        finally:
+            if not call.recorded:
+                self.record(False, (time.monotonic() - started) * 1000)
+
+    def record(self, success, elapsed_ms):
+        failed = not success or elapsed_ms > settings.BREAKER_SLOW_CALL_MS
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self._recent.clear()
+                return
+
+            self._recent.append(failed)
+            if (self.state == self.CLOSED and len(self._recent) >= settings.BREAKER_MIN_CALLS
+                    and sum(self._recent) / len(self._recent) >= settings.BREAKER_FAILURE_RATE):
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._recent.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'recent_calls': len(self._recent),
+                'recent_failures': sum(self._recent),
+                'rejected': self.rejected,
+            }
+
+
+class _Call:
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self.recorded = False
+
+    def record(self, success, elapsed_ms):
+        self.recorded = True
+        self.breaker.record(success, elapsed_ms)
+
+
+_lock = threading.Lock()
+breakers = {}
+
+
+def breaker_for(upstream):
+    with _lock:
+        if upstream not in breakers:
+            breakers[upstream] = CircuitBreaker(upstream)
+        return breakers[upstream]
+
+
+def collect_metrics():
+    snapshots = {name: breaker.snapshot() for name, breaker in list(breakers.items())}
+    states = [
+        ({'upstream': name, 'state': state}, int(snapshot['state'] == state))
+        for name, snapshot in sorted(snapshots.items())
+        for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)
+    ]
+    rejected = [({'upstream': name}, snapshot['rejected']) for name, snapshot in sorted(snapshots.items())]
+    return [
+        ('breaker_state', 'gauge', "1 for the current state of each upstream's circuit breaker", states),
+        ('breaker_rejected_total', 'counter', "Calls failed fast while a circuit breaker was open", rejected),
+    ]
+
+
+metrics.register_collector(collect_metrics)
@@ -0,0 +1,44 @@
+# KJObackend/caching.py
+import threading
+
+from . import metrics
+
+
+class CacheStats:
+    # Per-process hit/miss/stale counters for one cache
+    def __init__(self, name, outcomes=('hit', 'miss', 'stale', 'fallback')):
+        self.name = name
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(outcomes, 0)
+
+    def incr(self, outcome, amount=1):
+        with self._lock:
+            self._counts[outcome] = self._counts.get(outcome, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+cache_stats = {}
+
+
+def stats_for(name):
+    return cache_stats.setdefault(name, CacheStats(name))
+
+
+def collect_metrics():
+    lookups, ratios = [], []
+    for name, stats in sorted(cache_stats.items()):
+        counts = stats.snapshot()
+        lookups.extend(({'cache': name, 'outcome': outcome}, count) for outcome, count in counts.items())
+        total = sum(counts.values())
+        if total:
+            ratios.append(({'cache': name}, round(counts.get('hit', 0) / total, 4)))
+    return [
+        ('cache_lookups_total', 'counter', "Cache lookups by outcome", lookups),
+        ('cache_hit_ratio', 'gauge', "Share of cache lookups that were hits since the process started", ratios),
+    ]
+
+
+metrics.register_collector(collect_metrics)
@@ -0,0 +1,172 @@
+# KJObackend/destinations.py
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from openai import OpenAIError
+from requests import RequestException
+
+from . import ratelimit
+from .breaker import UpstreamUnavailable
+from .models import DestinationResolution
+from .external_apis import get_country_code, get_country_codes, get_coordinates
+from .external_apis_async import aget_country_code, aget_coordinates
+from .singleflight import coalesced, acoalesced
+
+logger = logging.getLogger(__name__)
+
+# A bulk lookup that hits one of these leaves the destinations concerned unresolved
+UPSTREAM_ERRORS = (UpstreamUnavailable, RequestException, OpenAIError)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='destinations')
+
+
+def normalize_destination(city_name):
+    return " ".join((city_name or "").split()).casefold()
+
+
+@coalesced('destination', key=lambda city_name: normalize_destination(city_name))
+def resolve_destination(city_name):
+    """
+    Returns a DestinationResolution for the city, or None if we can't tell which
+    country it is in. Known destinations are answered from the database; new ones
+    are looked up upstream and stored once both the country and coordinates are known.
+    """
+    key = normalize_destination(city_name)
+    if not key:
+        return None
+
+    resolution = DestinationResolution.objects.filter(destination_key=key).first()
+    if resolution is not None:
+        return resolution
+
+    country_code = get_country_code(city_name)
+    if not country_code:
+        return None
+
+    lat, lon = get_coordinates(city_name, country_code)
+    if lat is None or lon is None:
+        # Don't remember a failed geocode, it may just have been a bad moment upstream
+        return DestinationResolution(destination_key=key, country_code=country_code)
+
+    resolution, _ = DestinationResolution.objects.update_or_create(
+        destination_key=key,
+        defaults=resolution_fields(country_code, lat, lon),
+    )
+    return resolution
+
+
+@acoalesced('destination', key=lambda city_name: normalize_destination(city_name))
+async def aresolve_destination(city_name):
+    key = normalize_destination(city_name)
+    if not key:
+        return None
+
+    resolution = await DestinationResolution.objects.filter(destination_key=key).afirst()
+    if resolution is not None:
+        return resolution
+
+    country_code = await aget_country_code(city_name)
+    if not country_code:
+        return None
+
+    lat, lon = await aget_coordinates(city_name, country_code)
+    if lat is None or lon is None:
+        return DestinationResolution(destination_key=key, country_code=country_code)
+
+    resolution, _ = await DestinationResolution.objects.aupdate_or_create(
+        destination_key=key,
+        defaults=resolution_fields(country_code, lat, lon),
+    )
+    return resolution
+
+
+def resolution_fields(country_code, lat, lon):
+    return {
+        'country_code': country_code,
+        'lat': lat,
+        'lon': lon,
+        'resolved_at': timezone.now(),
+    }
+
+
+def resolve_destinations(city_names, batch_size=None, max_new=None):
+    """
+    Bulk resolve_destination: returns {city name: DestinationResolution or None}.
+    Stored destinations come from one query, and the country codes of the new
+    ones are asked for in batches instead of one completion per city. Only the
+    first max_new new destinations are looked up (all when None), the others are
+    left unresolved and resolved in the background. A destination whose lookup
+    fails upstream is left unresolved rather than failing the rest.
+    """
+    by_key = {}
+    for city_name in city_names:
+        key = normalize_destination(city_name)
+        if key:
+            by_key.setdefault(key, []).append(city_name)
+
+    stored = {resolution.destination_key: resolution for resolution in DestinationResolution.objects.filter(destination_key__in=by_key)}
+    new_keys = [key for key in by_key if key not in stored]
+    later = [by_key[key][0] for key in new_keys[max_new:]] if max_new is not None else []
+    new_keys = new_keys[:max_new]
+    new_names = [by_key[key][0] for key in new_keys]
+    batch_size = batch_size or settings.COUNTRY_CODE_BATCH_SIZE
+    codes = {}
+    for i in range(0, len(new_names), batch_size):
+        try:
+            codes.update(get_country_codes(new_names[i:i + batch_size], batch_size))
+        except UPSTREAM_ERRORS as error:
+            logger.warning('country codes unavailable for %d destination(s): %r', len(new_names[i:i + batch_size]), error)
+
+    resolutions = dict(stored)
+    for key, city_name in zip(new_keys, new_names):
+        country_code = codes.get(city_name)
+        if not country_code:
+            continue
+        try:
+            lat, lon = get_coordinates(city_name, country_code)
+        except UPSTREAM_ERRORS as error:
+            logger.warning('coordinates unavailable for %r: %r', city_name, error)
+            continue
+        if lat is None or lon is None:
+            continue
+        resolutions[key], _ = DestinationResolution.objects.update_or_create(
+            destination_key=key,
+            defaults=resolution_fields(country_code, lat, lon),
+        )
+
+    if later:
+        schedule_warm_destinations(later)
+    return {city_name: resolutions.get(normalize_destination(city_name)) for city_name in city_names}
+
+
+def warm_destinations(city_names, batch_size=None):
+    # Resolves every destination not already stored. Returns (resolved, failed) names.
+    known = set(DestinationResolution.objects.values_list('destination_key', flat=True))
+    new = {}
+    for city_name in city_names:
+        key = normalize_destination(city_name)
+        if key and key not in known:
+            new.setdefault(key, city_name)
+    new = list(new.values())
+
+    resolutions = resolve_destinations(new, batch_size)
+    resolved = [city_name for city_name in new if resolutions[city_name] is not None]
+    failed = [city_name for city_name in new if resolutions[city_name] is None]
+    return resolved, failed
+
+
+def schedule_warm_destinations(city_names):
+    # warm_destinations in a background thread, queued behind interactive calls for the rate limits
+    def warm():
+        try:
+            with ratelimit.priority(ratelimit.BACKGROUND):
+                warm_destinations(city_names)
+        except Exception:
+            logger.exception('resolving %d destination(s) in the background failed', len(city_names))
+        finally:
+            connections.close_all()
+
+    _executor.submit(warm)
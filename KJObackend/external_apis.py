@@ -1,159 +1,588 @@
 #external_apis.py
-import requests
 import os
-import openai
 import json
-from datetime import datetime, timezone, date
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone, date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connections
+from django.utils import timezone as django_timezone
+
+from requests import RequestException
+
+from . import http_client, ratelimit
+from .breaker import UpstreamUnavailable
+from .caching import stats_for
+from .gazetteer import gazetteer, normalize_name
+from .metrics import instrumented
+from .models import WeatherSummary, TicketmasterDay, WeatherDay
+from .singleflight import coalesced
 
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
 TM_API_KEY = os.getenv('TICKETMASTER_API_KEY')
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OWM_API_KEY = os.getenv('WEATHER_API_KEY')
 
-BASE_URL_TM = 'https://app.ticketmaster.com/discovery/v2/events.json'
-GEOCODE_URL = "https://api.openweathermap.org/geo/1.0/direct"
-ONECALL_URL = "https://api.openweathermap.org/data/2.5/weather"
+logger = logging.getLogger(__name__)
+
+# The hosts come from settings so a stand-in server can replace them (see standin_upstreams)
+BASE_URL_TM = f"{settings.TICKETMASTER_BASE_URL}/discovery/v2/events.json"
+GEOCODE_URL = f"{settings.OPENWEATHER_BASE_URL}/geo/1.0/direct"
+FORECAST_URL = f"{settings.OPENWEATHER_BASE_URL}/data/2.5/forecast"
 
+weather_cache_stats = stats_for('weather')
+summary_cache_stats = stats_for('weather_summary')
+events_cache_stats = stats_for('ticketmaster_days')
 
-# Weather API (coordinates and todays weather forecast)
 
+# Weather API (coordinates and daily forecasts)
+
+@instrumented('coordinates')
+@coalesced('coordinates')
 def get_coordinates(city_name, country_code, limit=1):
-    params = {
+    res = http_client.get(GEOCODE_URL, params=coordinates_params(city_name, country_code, limit), upstream='openweather')
+    return parse_coordinates(http_client.check_status(res, 'openweather').json())
+
+def coordinates_params(city_name, country_code, limit=1):
+    return {
         "q": f"{city_name},{country_code}",
         "limit": limit,
         "appid": OWM_API_KEY,
     }
 
-    res = requests.get(GEOCODE_URL, params=params, timeout=8)
-    if res.status_code != 200:
-        return None, None
-
-    data = res.json()
+def parse_coordinates(data):
     if not data:
         return None, None
 
     first = data[0]
     return first.get("lat"), first.get("lon")
 
-def get_weather_forecast(lat, lon):
+# Forecast per day of the trip, stored per (grid cell, day); the days we don't have come
+# from one call to the 5 day / 3 hour forecast. Days that expired less than WEATHER_DAY_STALE
+# seconds ago are served as they are while the cell is refetched in the background.
+@instrumented('weather')
+@coalesced('weather')
+def get_weather_forecast(lat, lon, start_date, end_date):
     if lat is None or lon is None:
         return ["Location not found"]
 
-    params = {
+    lat, lon = weather_cell(lat, lon)
+    cell_key = f"{lat}:{lon}"
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    by_day, stale, expired = load_weather_days(cell_key, start_date, end_date)
+
+    missing = missing_forecast_days(days, by_day)
+    if missing and all(day in stale for day in missing):
+        weather_cache_stats.incr('stale', len(missing))
+        refresh_weather_cell(lat, lon, cell_key)
+        by_day.update(stale)
+        missing = []
+    expired.update(stale)
+    weather_cache_stats.incr('miss', len(missing))
+    if missing:
+        try:
+            by_day.update(fetch_weather_days(lat, lon, cell_key))
+        except (UpstreamUnavailable, RequestException):
+            if not expired and not by_day:
+                raise
+            weather_cache_stats.incr('fallback')
+
+    return assemble_forecast(days, by_day, expired)
+
+def weather_cell(lat, lon):
+    # Nearby coordinates share one grid cell (and one upstream call per WEATHER_DAY_TTL)
+    grid = settings.WEATHER_CACHE_GRID
+    return round(round(lat / grid) * grid, 4), round(round(lon / grid) * grid, 4)
+
+def is_forecast(forecast):
+    return bool(forecast) and isinstance(forecast[0], dict)
+
+def missing_forecast_days(days, by_day):
+    # Days we have no fresh forecast for that the forecast API covers (today and the next few days)
+    today = datetime.now(timezone.utc).date()
+    horizon = today + timedelta(days=settings.WEATHER_FORECAST_DAYS)
+    return [day for day in days if day not in by_day and today <= day <= horizon]
+
+def load_weather_days(cell_key, start_date, end_date):
+    # Stored days in the window, split into fresh ones, stale ones (still served while a refresh
+    # runs) and older ones (kept as a fallback, and as the only forecast we'll ever have for
+    # days that are already past)
+    now = django_timezone.now()
+    fresh_since = now - timedelta(seconds=settings.WEATHER_DAY_TTL)
+    stale_since = fresh_since - timedelta(seconds=settings.WEATHER_DAY_STALE)
+    stored = WeatherDay.objects.filter(
+        cell_key=cell_key,
+        day__range=(start_date, end_date),
+    ).values_list('day', 'forecast', 'fetched_at')
+    by_day = {}
+    stale = {}
+    expired = {}
+    for day, forecast, fetched_at in stored:
+        if fetched_at >= fresh_since:
+            by_day[day] = forecast
+        elif fetched_at >= stale_since:
+            stale[day] = forecast
+        else:
+            expired[day] = forecast
+
+    weather_cache_stats.incr('hit', len(by_day))
+    return by_day, stale, expired
+
+def weather_refresh_key(cell_key):
+    return f"weather_refresh:{cell_key}"
+
+def refresh_weather_cell(lat, lon, cell_key):
+    # Only one refresh per cell at a time, also across workers sharing the cache
+    if not cache.add(weather_refresh_key(cell_key), True, timeout=60):
+        return
+
+    def refresh():
+        try:
+            with ratelimit.priority(ratelimit.BACKGROUND):
+                fetch_weather_days(lat, lon, cell_key)
+        except Exception as error:
+            # The stale days keep being served; the next stale read tries again
+            logger.warning('weather refresh for %s failed: %r', cell_key, error)
+        finally:
+            cache.delete(weather_refresh_key(cell_key))
+            connections.close_all()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+def fetch_weather_days(lat, lon, cell_key):
+    res = http_client.get(FORECAST_URL, params=weather_params(lat, lon), upstream='openweather')
+    by_day = parse_forecast_days(http_client.check_status(res, 'openweather').json())
+    store_weather_days(cell_key, by_day)
+    return by_day
+
+def weather_params(lat, lon):
+    return {
         "lat": lat,
         "lon": lon,
         "units": "metric",
         "appid": OWM_API_KEY,
     }
 
-    res = requests.get("https://api.openweathermap.org/data/2.5/weather", params=params, timeout=8)
-
-    if res.status_code != 200:
-        return [f"Weather API error {res.status_code}"]
-
-    data = res.json()
-    d_date = datetime.fromtimestamp(data["dt"], tz=timezone.utc).date()
-
-    return [{
-        "date": str(d_date),
-        "location": data.get("name"),
-        "country": data["sys"].get("country"),
-        "weather_main": data["weather"][0].get("main"),
-        "weather_description": data["weather"][0].get("description").title(),
-        "temperature": data["main"].get("temp"),
-        "feels_like": data["main"].get("feels_like"),
-        "temp_min": data["main"].get("temp_min"),
-        "temp_max": data["main"].get("temp_max"),
-        "pressure": data["main"].get("pressure"),
-        "humidity": data["main"].get("humidity"),
-        "wind_speed": data["wind"].get("speed"),
-        "wind_deg": data["wind"].get("deg"),
-        "cloudiness": data["clouds"].get("all"),
-        "visibility": data.get("visibility"),
-        "sunrise": datetime.fromtimestamp(data["sys"]["sunrise"], tz=timezone.utc).strftime('%H:%M:%S'),
-        "sunset": datetime.fromtimestamp(data["sys"]["sunset"], tz=timezone.utc).strftime('%H:%M:%S'),
-    }]
-
-# TicketMaster API (events)
+def parse_forecast_days(data):
+    # Folds the 3-hourly entries into one forecast per local day
+    city = data.get("city", {})
+    offset = timedelta(seconds=city.get("timezone", 0))
+    entries_by_day = {}
+    for entry in data.get("list", []):
+        local_day = (datetime.fromtimestamp(entry["dt"], tz=timezone.utc) + offset).date()
+        entries_by_day.setdefault(local_day, []).append(entry)
+
+    by_day = {}
+    for day, entries in entries_by_day.items():
+        conditions = [entry["weather"][0] for entry in entries]
+        main = max(set(c.get("main") for c in conditions), key=[c.get("main") for c in conditions].count)
+        by_day[day] = {
+            "date": str(day),
+            "location": city.get("name"),
+            "country": city.get("country"),
+            "weather_main": main,
+            "weather_description": next(c.get("description", "") for c in conditions if c.get("main") == main).title(),
+            "temp_min": min(entry["main"]["temp_min"] for entry in entries),
+            "temp_max": max(entry["main"]["temp_max"] for entry in entries),
+            "humidity": round(sum(entry["main"].get("humidity", 0) for entry in entries) / len(entries)),
+            "wind_speed": max(entry.get("wind", {}).get("speed", 0) for entry in entries),
+            "cloudiness": round(sum(entry.get("clouds", {}).get("all", 0) for entry in entries) / len(entries)),
+            "precipitation_probability": max(entry.get("pop", 0) for entry in entries),
+            "sunrise": datetime.fromtimestamp(city["sunrise"], tz=timezone.utc).strftime('%H:%M:%S') if "sunrise" in city else None,
+            "sunset": datetime.fromtimestamp(city["sunset"], tz=timezone.utc).strftime('%H:%M:%S') if "sunset" in city else None,
+        }
+    return by_day
+
+def store_weather_days(cell_key, by_day):
+    now = django_timezone.now()
+    for day, forecast in by_day.items():
+        WeatherDay.objects.update_or_create(
+            cell_key=cell_key,
+            day=day,
+            defaults={'forecast': forecast, 'fetched_at': now},
+        )
+
+def assemble_forecast(days, by_day, expired):
+    forecast = [by_day.get(day) or expired.get(day) for day in days]
+    forecast = [day_forecast for day_forecast in forecast if day_forecast]
+    if not forecast:
+        return ["No forecast available for these dates yet"]
+    return forecast
+
+# TicketMaster API (events), cached per (city, country, day)
+@instrumented('ticketmaster_events')
+@coalesced('ticketmaster_events')
 def get_ticketmaster_events(city_name, country_code, start_date, end_date):
-    # Fix correct date format
-    start_date = start_date.strftime('%Y-%m-%dT00:00:00Z')
-    end_date = end_date.strftime('%Y-%m-%dT23:59:59Z')
-    
-    params = {
+    city_key = normalize_name(city_name)
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    by_day, expired = load_ticketmaster_days(city_key, country_code, start_date, end_date)
+    missing = [day for day in days if day not in by_day]
+
+    # Only the days we don't have are fetched, one upstream call per contiguous run
+    for run_start, run_end in contiguous_runs(missing):
+        try:
+            by_day.update(fetch_ticketmaster_days(city_name, city_key, country_code, run_start, run_end))
+        except (UpstreamUnavailable, RequestException):
+            # Ticketmaster is down: serve what we had for these days, however old
+            fallback = {day: day_events for day, day_events in expired.items() if run_start <= day <= run_end}
+            if not fallback and not by_day:
+                raise
+            by_day.update(fallback)
+
+    return assemble_events(days, by_day)
+
+def load_ticketmaster_days(city_key, country_code, start_date, end_date):
+    # Stored days in the window, split into fresh ones and expired ones (kept as a fallback)
+    fresh_since = django_timezone.now() - timedelta(seconds=settings.TICKETMASTER_DAY_TTL)
+    stored = TicketmasterDay.objects.filter(
+        city_key=city_key,
+        country_code=country_code,
+        day__range=(start_date, end_date),
+    ).values_list('day', 'events', 'fetched_at')
+    by_day = {}
+    expired = {}
+    for day, day_events, fetched_at in stored:
+        (by_day if fetched_at >= fresh_since else expired)[day] = day_events
+
+    wanted = (end_date - start_date).days + 1
+    events_cache_stats.incr('hit', len(by_day))
+    events_cache_stats.incr('miss', wanted - len(by_day))
+    return by_day, expired
+
+def assemble_events(days, by_day):
+    events = []
+    seen = set()
+    for day in days:
+        for event in by_day.get(day, []):
+            if event['id'] in seen:
+                continue
+            seen.add(event['id'])
+            events.append({
+                'name': event['name'],
+                'date': event['date'],
+                'url': event['url'],
+                'category': event.get('category'),
+            })
+
+    if not events:
+        logger.debug("No events found")
+        return ["No events found"]
+
+    return events
+
+def contiguous_runs(days):
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][1] == timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+def fetch_ticketmaster_days(city_name, city_key, country_code, start_date, end_date):
+    pages = TicketmasterPages(ticketmaster_params(city_name, country_code, start_date, end_date))
+    days = TicketmasterDays(start_date, end_date)
+    for event in pages.events():
+        if not days.add(event):
+            break  # enough events; the remaining pages are never requested
+
+    complete_until = days.complete_until(pages.exhausted)
+    store_ticketmaster_days(city_key, country_code, days.by_day, complete_until)
+    return days.by_day
+
+def ticketmaster_params(city_name, country_code, start_date, end_date):
+    return {
         'apikey': TM_API_KEY,
         'keyword': city_name,
         'countryCode': country_code,
-        'startDateTime': start_date,
-        'endDateTime': end_date,
-        'size': 10
+        'startDateTime': start_date.strftime('%Y-%m-%dT00:00:00Z'),
+        'endDateTime': end_date.strftime('%Y-%m-%dT23:59:59Z'),
+        'sort': 'date,asc',
+        'size': settings.TICKETMASTER_PAGE_SIZE,
     }
-    
-    response = requests.get(BASE_URL_TM, params=params)
-    data = response.json()
 
-    events = data.get('_embedded', {}).get('events', [])
-    if not events:
-        print("No events found")
-        return ["No events found"]
+class TicketmasterPages:
+    """
+    Lazily walks the result pages of one Ticketmaster search, requesting the next
+    page only when the previous one has been consumed (iterate with for or async for).
+    Stops after TICKETMASTER_MAX_PAGES pages or at Ticketmaster's deep paging limit of
+    1000 results; exhausted tells whether every page was read. A page that doesn't come
+    back with 200 raises UpstreamUnavailable, so nothing is stored for the search.
+    """
 
-    return [
-        {
-            'name': event['name'],
-            'date': event['dates']['start']['localDate'],
-            'url': event.get('url', None)
-        }
-        for event in events
-    ]
+    def __init__(self, params, max_pages=None):
+        self.params = params
+        self.max_pages = min(max_pages or settings.TICKETMASTER_MAX_PAGES, 1000 // params['size'])
+        self.exhausted = False
 
+    def _last_page(self, data, number):
+        total_pages = data.get('page', {}).get('totalPages', 0)
+        return number + 1 >= total_pages
 
-# OpenAI API (country code from city name)
+    def __iter__(self):
+        for number in range(self.max_pages):
+            response = http_client.get(BASE_URL_TM, params={**self.params, 'page': number}, upstream='ticketmaster')
+            data = http_client.check_status(response, 'ticketmaster').json()
+            yield data
+            if self._last_page(data, number):
+                self.exhausted = True
+                return
+
+    async def __aiter__(self):
+        for number in range(self.max_pages):
+            response = await http_client.aget(BASE_URL_TM, params={**self.params, 'page': number}, upstream='ticketmaster')
+            data = http_client.check_status(response, 'ticketmaster').json()
+            yield data
+            if self._last_page(data, number):
+                self.exhausted = True
+                return
+
+    def events(self):
+        for data in self:
+            yield from data.get('_embedded', {}).get('events', [])
+
+    async def aevents(self):
+        async for data in self:
+            for event in data.get('_embedded', {}).get('events', []):
+                yield event
+
+def project_ticketmaster_event(event):
+    # Only the fields we keep
+    local_date = event.get('dates', {}).get('start', {}).get('localDate')
+    if not local_date:
+        return None
+    classifications = event.get('classifications') or [{}]
+    return {
+        'id': event['id'],
+        'name': event['name'],
+        'date': local_date,
+        'url': event.get('url', None),
+        'category': classifications[0].get('segment', {}).get('name'),
+    }
+
+class TicketmasterDays:
+    # Collects events (sorted by date) per day, keeping at most TICKETMASTER_MAX_EVENTS_PER_DAY a day
+
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.by_day = {start_date + timedelta(days=i): [] for i in range((end_date - start_date).days + 1)}
+        self.seen = 0
+        self.last_day = None
+        self.stopped = False
+
+    def add(self, event):
+        # Returns False once TICKETMASTER_MAX_EVENTS events were seen and the rest can be skipped
+        event = project_ticketmaster_event(event)
+        day = date.fromisoformat(event['date']) if event else None
+        if day not in self.by_day:
+            return True
+        if len(self.by_day[day]) < settings.TICKETMASTER_MAX_EVENTS_PER_DAY:
+            self.by_day[day].append(event)
+        self.seen += 1
+        self.last_day = day
+        self.stopped = self.seen >= settings.TICKETMASTER_MAX_EVENTS
+        return not self.stopped
+
+    def complete_until(self, exhausted):
+        # The last day we have all events for (or the capped share of them)
+        if exhausted and not self.stopped:
+            return self.end_date
+        # Sorted by date, so only the days before the last event seen are complete
+        return (self.last_day or self.start_date) - timedelta(days=1)
+
+def store_ticketmaster_days(city_key, country_code, by_day, complete_until):
+    now = django_timezone.now()
+    for day, day_events in by_day.items():
+        if day > complete_until:
+            break
+        TicketmasterDay.objects.update_or_create(
+            city_key=city_key,
+            country_code=country_code,
+            day=day,
+            defaults={'events': day_events, 'fetched_at': now},
+        )
+
+# Country code from city name: bundled gazetteer first, OpenAI for names it doesn't know
+@instrumented('country_code')
+@coalesced('country_code')
 def get_country_code(city_name, max_attempts=3):
-    prompt = (
+    code = gazetteer.country_code(city_name)
+    if code:
+        return code
+    return get_country_code_from_llm(city_name, max_attempts)
+
+# OpenAI API (country code from city name)
+def get_country_code_from_llm(city_name, max_attempts=3):
+    prompt = country_code_prompt(city_name)
+
+    for _ in range(max_attempts):
+        response = http_client.chat_completion(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"}
+        )
+        code = parse_country_code(response.choices[0].message.content)
+        if code:
+            return code
+    return False
+
+def country_code_prompt(city_name):
+    return (
         f"Act as a location expert would. Given the name of a city, respond ONLY (!) with a JSON object containing the 2-letter country code of the most likely country for that city, "
         f"using the field 'country_code'. If you cannot determine the country confidently, respond with 'false'. If the city name is empty, respond with 'false'. "
         f"Do not return any explanation, only the JSON object or false. City: {city_name}"
     )
 
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
+def parse_country_code(content):
+    answer = json.loads(content.strip())
+    code = answer.get("country_code", "") if isinstance(answer, dict) else ""
+    if isinstance(code, str) and len(code) == 2:
+        return code.upper()
+    return None
+
+# Country codes for many cities at once: the gazetteer answers what it can and the
+# rest go to the LLM in batches of COUNTRY_CODE_BATCH_SIZE, one completion per batch
+@instrumented('country_codes')
+def get_country_codes(city_names, batch_size=None):
+    batch_size = batch_size or settings.COUNTRY_CODE_BATCH_SIZE
+    codes = {}
+    unknown = []
+    for city_name in dict.fromkeys(city_names):
+        codes[city_name] = gazetteer.country_code(city_name) or False
+        if not codes[city_name]:
+            unknown.append(city_name)
+
+    for i in range(0, len(unknown), batch_size):
+        codes.update(get_country_codes_from_llm(unknown[i:i + batch_size]))
+    return codes
 
+def get_country_codes_from_llm(city_names, max_attempts=2):
+    codes = dict.fromkeys(city_names, False)
+    remaining = list(city_names)
+
+    # A retry only asks again for the cities the previous answer left out
     for _ in range(max_attempts):
-        response = client.chat.completions.create(
+        if not remaining:
+            break
+        response = http_client.chat_completion(
             model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
+            messages=[{"role": "user", "content": country_codes_prompt(remaining)}],
             response_format={"type": "json_object"}
         )
-        content = response.choices[0].message.content.strip()
-        code = json.loads(content).get("country_code", "")
-        if isinstance(code, str) and len(code) == 2:
-            return code.upper()
-        else: 
-            continue
-    return False
+        answered = parse_country_codes(response.choices[0].message.content, remaining)
+        codes.update(answered)
+        remaining = [city_name for city_name in remaining if city_name not in answered]
+    return codes
 
-# OpenAI API (weather summary)
-def interpret_weather_forecast(weather_data):
-    wd = weather_data[0]
-    prompt = (
-        f"Write a natural-language weather summary for location = {wd['location']}, country = {wd['country']}, with a high of temp_max = {wd['temp_max']}°C, "
-        f"low of temp_min = {wd['temp_min']}°C, sunrise = {wd['sunrise']}, and sunset = {wd['sunset']}. "
-        f"Keep it under 70 words, no bullet points, no repetition, and make it sound natural. Just one short paragraph."
+def country_codes_prompt(city_names):
+    return (
+        f"Act as a location expert would. Given a JSON list of city names, respond ONLY (!) with a JSON object with the field 'country_codes': "
+        f"a list with, for each city in the same order, the 2-letter country code of the most likely country for that city, "
+        f"or false if you cannot determine the country confidently or the name is empty. "
+        f"Do not return any explanation, only the JSON object. Cities: {json.dumps(city_names, ensure_ascii=False)}"
     )
 
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
+def parse_country_codes(content, city_names):
+    # Returns {city name: code or False} for the cities the answer covers; a malformed answer covers none
+    try:
+        answer = json.loads(content.strip())
+    except ValueError:
+        return {}
+    codes = answer.get("country_codes") if isinstance(answer, dict) else None
+    if not isinstance(codes, list) or len(codes) != len(city_names):
+        return {}
+    return {
+        city_name: code.upper() if isinstance(code, str) and len(code) == 2 else False
+        for city_name, code in zip(city_names, codes)
+    }
+
+# OpenAI API (weather summary for the whole trip, one completion), memoized in the database
+@instrumented('weather_summary')
+@coalesced('weather_summary')
+def interpret_weather_forecast(weather_data):
+    if not is_forecast(weather_data):
+        return None
+    inputs = weather_summary_inputs(weather_data)
+    key = weather_summary_key(inputs)
+
+    cached = cached_weather_summary(key)
+    if cached is not None:
+        return {
+            'Summary': cached
+        }
+
+    summary = fetch_weather_summary(inputs)
+    store_weather_summary(key, summary)
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    summary = response.choices[0].message.content.strip()
-    
     return {
         'Summary': summary
     }
 
+def weather_summary_inputs(days):
+    # Forecasts that only differ by a fraction of a degree or a few percent of rain share a summary
+    step = settings.WEATHER_SUMMARY_TEMP_STEP
+    return {
+        'location': days[0]['location'],
+        'country': days[0]['country'],
+        'days': [{
+            'date': wd['date'],
+            'weather': wd['weather_main'],
+            'temp_max': round(round(wd['temp_max'] / step) * step, 1),
+            'temp_min': round(round(wd['temp_min'] / step) * step, 1),
+            'rain': round(wd.get('precipitation_probability', 0), 1),
+        } for wd in days],
+    }
+
+def weather_summary_key(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def cached_weather_summary(key):
+    cached = WeatherSummary.objects.filter(key=key).values_list('summary', flat=True).first()
+    if cached is None:
+        summary_cache_stats.incr('miss')
+        return None
+
+    summary_cache_stats.incr('hit')
+    WeatherSummary.objects.filter(key=key).update(last_used_at=django_timezone.now())
+    return cached
+
+def fetch_weather_summary(wd):
+    response = http_client.chat_completion(
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": weather_summary_prompt(wd)}]
+    )
+    return response.choices[0].message.content.strip()
+
+def weather_summary_prompt(wd):
+    daily = "; ".join(
+        f"{day['date']}: {day['weather']}, high {day['temp_max']}°C, low {day['temp_min']}°C, {day['rain']:.0%} chance of rain"
+        for day in wd['days']
+    )
+    return (
+        f"Write a natural-language weather summary for a trip to location = {wd['location']}, country = {wd['country']}, "
+        f"from {wd['days'][0]['date']} to {wd['days'][-1]['date']}. Daily forecast: {daily}. "
+        f"Cover the whole period and mention notable changes between days. "
+        f"Keep it under 90 words, no bullet points, no repetition, and make it sound natural. Just one short paragraph."
+    )
+
+def store_weather_summary(key, summary):
+    try:
+        WeatherSummary.objects.create(key=key, summary=summary)
+    except IntegrityError:
+        # Another worker stored the same summary first
+        return
+
+    # Least recently used summaries go once the table is over its cap
+    cap = settings.WEATHER_SUMMARY_CACHE_SIZE
+    if WeatherSummary.objects.count() > cap:
+        expired = WeatherSummary.objects.order_by('-last_used_at').values_list('id', flat=True)[cap:]
+        WeatherSummary.objects.filter(id__in=list(expired)).delete()
+
 # Helper function
 def unix_to_date(ts):
     return datetime.fromtimestamp(ts, tz=timezone.utc).date()
\ No newline at end of file
@@ -0,0 +1,177 @@
+# KJObackend/external_apis_async.py
+#
+# Async counterparts of the functions in external_apis.py, for the ASGI views. They
+# share the request building, parsing and caching rules with the sync versions and
+# only differ in how they wait for I/O.
+import asyncio
+import logging
+from datetime import timedelta
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from . import http_client, ratelimit
+from .breaker import UpstreamUnavailable
+from .gazetteer import gazetteer, normalize_name
+from .metrics import instrumented
+from .singleflight import acoalesced
+from .external_apis import (
+    GEOCODE_URL, FORECAST_URL, weather_cache_stats,
+    coordinates_params, parse_coordinates,
+    weather_cell, is_forecast, missing_forecast_days, load_weather_days, weather_refresh_key, weather_params,
+    parse_forecast_days, store_weather_days, assemble_forecast,
+    load_ticketmaster_days, assemble_events, contiguous_runs,
+    ticketmaster_params, TicketmasterPages, TicketmasterDays, store_ticketmaster_days,
+    country_code_prompt, parse_country_code,
+    weather_summary_inputs, weather_summary_key, cached_weather_summary, weather_summary_prompt, store_weather_summary,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@instrumented('coordinates')
+@acoalesced('coordinates')
+async def aget_coordinates(city_name, country_code, limit=1):
+    res = await http_client.aget(GEOCODE_URL, params=coordinates_params(city_name, country_code, limit), upstream='openweather')
+    return parse_coordinates(http_client.check_status(res, 'openweather').json())
+
+
+@instrumented('weather')
+@acoalesced('weather')
+async def aget_weather_forecast(lat, lon, start_date, end_date):
+    if lat is None or lon is None:
+        return ["Location not found"]
+
+    lat, lon = weather_cell(lat, lon)
+    cell_key = f"{lat}:{lon}"
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    by_day, stale, expired = await sync_to_async(load_weather_days)(cell_key, start_date, end_date)
+
+    missing = missing_forecast_days(days, by_day)
+    if missing and all(day in stale for day in missing):
+        weather_cache_stats.incr('stale', len(missing))
+        await arefresh_weather_cell(lat, lon, cell_key)
+        by_day.update(stale)
+        missing = []
+    expired.update(stale)
+    weather_cache_stats.incr('miss', len(missing))
+    if missing:
+        try:
+            by_day.update(await afetch_weather_days(lat, lon, cell_key))
+        except (UpstreamUnavailable, httpx.HTTPError):
+            if not expired and not by_day:
+                raise
+            weather_cache_stats.incr('fallback')
+
+    return assemble_forecast(days, by_day, expired)
+
+
+_background_refreshes = set()
+
+
+async def arefresh_weather_cell(lat, lon, cell_key):
+    # refresh_weather_cell as a task on the loop
+    if not await cache.aadd(weather_refresh_key(cell_key), True, timeout=60):
+        return
+
+    async def refresh():
+        try:
+            with ratelimit.priority(ratelimit.BACKGROUND):
+                await afetch_weather_days(lat, lon, cell_key)
+        except Exception as error:
+            logger.warning('weather refresh for %s failed: %r', cell_key, error)
+        finally:
+            await cache.adelete(weather_refresh_key(cell_key))
+
+    task = asyncio.create_task(refresh())
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
+
+
+async def afetch_weather_days(lat, lon, cell_key):
+    res = await http_client.aget(FORECAST_URL, params=weather_params(lat, lon), upstream='openweather')
+    by_day = parse_forecast_days(http_client.check_status(res, 'openweather').json())
+    await sync_to_async(store_weather_days)(cell_key, by_day)
+    return by_day
+
+
+@instrumented('ticketmaster_events')
+@acoalesced('ticketmaster_events')
+async def aget_ticketmaster_events(city_name, country_code, start_date, end_date):
+    city_key = normalize_name(city_name)
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    by_day, expired = await sync_to_async(load_ticketmaster_days)(city_key, country_code, start_date, end_date)
+    missing = [day for day in days if day not in by_day]
+
+    # The missing runs are independent, so they are fetched concurrently
+    runs = contiguous_runs(missing)
+    fetched = await asyncio.gather(
+        *(afetch_ticketmaster_days(city_name, city_key, country_code, run_start, run_end) for run_start, run_end in runs),
+        return_exceptions=True,
+    )
+    for (run_start, run_end), result in zip(runs, fetched):
+        if isinstance(result, (UpstreamUnavailable, httpx.HTTPError)):
+            fallback = {day: day_events for day, day_events in expired.items() if run_start <= day <= run_end}
+            if not fallback and not by_day:
+                raise result
+            result = fallback
+        elif isinstance(result, Exception):
+            raise result
+        by_day.update(result)
+
+    return assemble_events(days, by_day)
+
+
+async def afetch_ticketmaster_days(city_name, city_key, country_code, start_date, end_date):
+    pages = TicketmasterPages(ticketmaster_params(city_name, country_code, start_date, end_date))
+    days = TicketmasterDays(start_date, end_date)
+    async for event in pages.aevents():
+        if not days.add(event):
+            break
+
+    complete_until = days.complete_until(pages.exhausted)
+    await sync_to_async(store_ticketmaster_days)(city_key, country_code, days.by_day, complete_until)
+    return days.by_day
+
+
+@instrumented('country_code')
+@acoalesced('country_code')
+async def aget_country_code(city_name, max_attempts=3):
+    code = gazetteer.country_code(city_name)
+    if code:
+        return code
+
+    prompt = country_code_prompt(city_name)
+    for _ in range(max_attempts):
+        response = await http_client.achat_completion(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"}
+        )
+        code = parse_country_code(response.choices[0].message.content)
+        if code:
+            return code
+    return False
+
+
+@instrumented('weather_summary')
+@acoalesced('weather_summary')
+async def ainterpret_weather_forecast(weather_data):
+    if not is_forecast(weather_data):
+        return None
+    inputs = weather_summary_inputs(weather_data)
+    key = weather_summary_key(inputs)
+
+    cached = await sync_to_async(cached_weather_summary)(key)
+    if cached is None:
+        response = await http_client.achat_completion(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": weather_summary_prompt(inputs)}]
+        )
+        cached = response.choices[0].message.content.strip()
+        await sync_to_async(store_weather_summary)(key, cached)
+
+    return {
+        'Summary': cached
+    }
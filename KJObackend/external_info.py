@@ -0,0 +1,179 @@
+# KJObackend/external_info.py
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.db import connections
+
+from .destinations import resolve_destination, aresolve_destination
+from .external_apis import get_ticketmaster_events, get_weather_forecast, interpret_weather_forecast
+from .external_apis_async import aget_ticketmaster_events, aget_weather_forecast, ainterpret_weather_forecast
+
+
+EXTERNAL_INFO_STEPS = ('location', 'weather_forecast', 'events', 'weather_interpretation')
+
+
+class UpstreamGraph:
+    """
+    Runs a set of upstream calls concurrently. Every step starts as soon as the
+    steps it depends on have finished, and the whole graph is cut off at the deadline.
+    A step is skipped if one of its dependencies failed, timed out or came back empty.
+    """
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.steps = {}
+
+    def add(self, name, func, after=()):
+        # func receives a dict with the results of the steps it depends on
+        self.steps[name] = (func, tuple(after))
+
+    @staticmethod
+    def _call(func, inputs):
+        try:
+            return func(inputs)
+        finally:
+            # Steps run in short-lived threads, so their database connections must not outlive them
+            connections.close_all()
+
+    def run(self):
+        results = {}
+        timings = {}
+        unusable = set()
+        pending = dict(self.steps)
+        running = {}
+        started = {}
+        cutoff = time.monotonic() + self.deadline
+
+        pool = ThreadPoolExecutor(max_workers=max(len(self.steps), 1))
+        try:
+            while True:
+                for name, (func, after) in list(pending.items()):
+                    if any(dep in unusable for dep in after):
+                        del pending[name]
+                        unusable.add(name)
+                    elif all(dep in results for dep in after):
+                        del pending[name]
+                        started[name] = time.monotonic()
+                        inputs = {dep: results[dep] for dep in after}
+                        # Steps inherit the caller's context (e.g. its rate limit priority)
+                        running[pool.submit(contextvars.copy_context().run, self._call, func, inputs)] = name
+
+                remaining = cutoff - time.monotonic()
+                if not running or remaining <= 0:
+                    break
+
+                done, _ = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    timings[name] = round((time.monotonic() - started[name]) * 1000, 1)
+                    try:
+                        value = future.result()
+                    except Exception:
+                        unusable.add(name)
+                        continue
+                    results[name] = value
+                    if not value:
+                        unusable.add(name)
+        finally:
+            # Don't let a hanging upstream hold the response past the deadline
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        missing = sorted(name for name in self.steps if name not in results)
+        return results, timings, missing
+
+
+def build_external_info(trip, deadline=None):
+    city_name = trip.destination
+    graph = UpstreamGraph(deadline if deadline is not None else settings.EXTERNAL_INFO_DEADLINE)
+
+    graph.add('location', lambda r: resolve_destination(city_name))
+    graph.add('weather_forecast', lambda r: get_weather_forecast(r['location'].lat, r['location'].lon, trip.start_date, trip.end_date), after=['location'])
+    graph.add('events', lambda r: get_ticketmaster_events(city_name, r['location'].country_code, trip.start_date, trip.end_date), after=['location'])
+    graph.add('weather_interpretation', lambda r: interpret_weather_forecast(r['weather_forecast']), after=['weather_forecast'])
+
+    results, timings, missing = graph.run()
+    return external_info_payload(results, timings, missing)
+
+
+async def astream_external_info(trip, deadline=None):
+    """
+    Async generator with the same steps as build_external_info. Yields
+    (name, value, elapsed_ms) for each step as soon as it finishes, so callers can
+    pass on the fast sections before the slow ones. Stops at the deadline.
+    """
+    city_name = trip.destination
+    finished = asyncio.Queue()
+
+    async def step(name, awaitable):
+        started = time.monotonic()
+        value = await awaitable
+        finished.put_nowait((name, value, round((time.monotonic() - started) * 1000, 1)))
+        return value
+
+    async def weather(location):
+        forecast = await step('weather_forecast', aget_weather_forecast(location.lat, location.lon, trip.start_date, trip.end_date))
+        if forecast:
+            await step('weather_interpretation', ainterpret_weather_forecast(forecast))
+
+    async def steps():
+        location = await step('location', aresolve_destination(city_name))
+        if location:
+            events = step('events', aget_ticketmaster_events(city_name, location.country_code, trip.start_date, trip.end_date))
+            await asyncio.gather(events, weather(location), return_exceptions=True)
+
+    async def run():
+        try:
+            await asyncio.wait_for(steps(), timeout=deadline if deadline is not None else settings.EXTERNAL_INFO_DEADLINE)
+        except Exception:
+            # Timed out or the location lookup failed; the caller reports the rest as missing
+            pass
+        finally:
+            finished.put_nowait(None)
+
+    task = asyncio.create_task(run())
+    try:
+        while (item := await finished.get()) is not None:
+            yield item
+    finally:
+        # The consumer went away early (e.g. the client disconnected)
+        task.cancel()
+
+
+async def abuild_external_info(trip, deadline=None):
+    results = {}
+    timings = {}
+    async for name, value, elapsed_ms in astream_external_info(trip, deadline):
+        results[name] = value
+        timings[name] = elapsed_ms
+    return external_info_payload(results, timings, missing_steps(results))
+
+
+def missing_steps(results):
+    return sorted(name for name in EXTERNAL_INFO_STEPS if name not in results)
+
+
+def external_info_payload(results, timings, missing):
+    if 'location' in results and not results['location']:
+        # We found no location, so no weather and no events
+        return {'events': [], 'timings': timings}
+
+    return {
+        'events': results.get('events', []),
+        'weather_interpretation': results.get('weather_interpretation'),
+        'timings': timings,
+        'missing': missing,
+    }
+
+
+def filter_events(events, day=None, category=None):
+    # Server-side ?day= / ?category= filtering of the events section
+    matching = [
+        event for event in events
+        if isinstance(event, dict)
+        and (day is None or event['date'] == day)
+        and (category is None or (event.get('category') or '').casefold() == category.casefold())
+    ]
+    return matching or ["No events found"]
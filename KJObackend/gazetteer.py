@@ -0,0 +1,122 @@
+# KJObackend/gazetteer.py
+#
+# Offline city -> country lookup. The bundled data/cities.csv is compiled into
+# data/cities.idx: fixed-size records sorted by normalized name (and by
+# population, largest first, within the same name), so lookups are a binary
+# search over a memory-mapped file and nothing is parsed at startup.
+# Rebuild the index with `python manage.py build_gazetteer` after editing the CSV.
+import csv
+import mmap
+import struct
+import threading
+import unicodedata
+from pathlib import Path
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+SOURCE_PATH = DATA_DIR / 'cities.csv'
+INDEX_PATH = DATA_DIR / 'cities.idx'
+
+KEY_SIZE = 40
+RECORD = struct.Struct(f'<{KEY_SIZE}s2sI')  # name key, country code, population
+
+# Letters NFKD doesn't split into a base letter and an accent
+_FOLD = str.maketrans({'ø': 'o', 'æ': 'ae', 'ł': 'l', 'đ': 'd', 'þ': 'th', 'ı': 'i'})
+
+
+def normalize_name(name):
+    decomposed = unicodedata.normalize('NFKD', (name or '').casefold())
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(stripped.translate(_FOLD).split())
+
+
+def build_index(source=SOURCE_PATH, target=INDEX_PATH):
+    best = {}
+    with open(source, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            key = normalize_name(row['name']).encode()
+            if not key or len(key) > KEY_SIZE:
+                continue
+            country_code = row['country_code'].strip().upper()
+            population = int(row['population'] or 0)
+            best[key, country_code] = max(population, best.get((key, country_code), 0))
+
+    records = sorted(best.items(), key=lambda item: (item[0][0], -item[1]))
+    with open(target, 'wb') as f:
+        for (key, country_code), population in records:
+            f.write(RECORD.pack(key, country_code.encode(), population))
+    return len(records)
+
+
+class Gazetteer:
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._buffer = None
+        self._count = 0
+
+    def _records(self):
+        # Map the index on first use only
+        if self._buffer is None:
+            with self._lock:
+                if self._buffer is None:
+                    with open(self.path, 'rb') as f:
+                        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._count = len(buffer) // RECORD.size
+                    self._buffer = buffer
+        return self._buffer
+
+    def _key(self, i):
+        offset = i * RECORD.size
+        return self._buffer[offset:offset + KEY_SIZE]
+
+    def _record(self, i):
+        key, country_code, population = RECORD.unpack_from(self._buffer, i * RECORD.size)
+        return key.rstrip(b'\0').decode(), country_code.decode(), population
+
+    def _lower_bound(self, key):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, name):
+        # Returns (name, country_code, population) of the most populous city with this name
+        key = normalize_name(name).encode()
+        if not key or len(key) > KEY_SIZE:
+            return None
+
+        self._records()
+        padded = key.ljust(KEY_SIZE, b'\0')
+        i = self._lower_bound(padded)
+        if i < self._count and self._key(i) == padded:
+            return self._record(i)
+        return None
+
+    def search_prefix(self, prefix, limit=10):
+        # Cities whose normalized name starts with prefix, most populous first
+        key = normalize_name(prefix).encode()
+        if not key:
+            return []
+
+        self._records()
+        matches = []
+        i = self._lower_bound(key)
+        while i < self._count and self._key(i).startswith(key):
+            matches.append(self._record(i))
+            i += 1
+        matches.sort(key=lambda record: -record[2])
+        return matches[:limit]
+
+    def country_code(self, name):
+        match = self.lookup(name)
+        if match is None and ',' in (name or ''):
+            # "Oslo, Norway" -> "Oslo"
+            match = self.lookup(name.split(',')[0])
+        return match[1] if match else None
+
+
+gazetteer = Gazetteer()
@@ -0,0 +1,298 @@
+# KJObackend/http_client.py
+#
+# Shared HTTP layer for the upstream APIs: one keep-alive session (connection pool)
+# per host, default timeouts, bounded retries with jittered backoff, per-host latency
+# stats and request metrics for /metrics.
+#
+# Every call first checks the upstream's circuit breaker and waits for its rate limit;
+# a 429 pauses the limit for everyone on the host. check_status turns other non-2xx
+# answers into UpstreamUnavailable.
+#
+# The OpenAI client is created once per process (a local stub when OPENAI_STUB is
+# set). The async variants (aget, achat_completion) keep one httpx/OpenAI client per
+# event loop.
+import asyncio
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+import httpx
+import openai
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import metrics, ratelimit
+from .breaker import UpstreamUnavailable, breaker_for
+from .llm_stub import RecordedOpenAI, AsyncRecordedOpenAI
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms, error=False):
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'avg_ms': round(self.total_ms / self.requests, 1) if self.requests else None,
+                'max_ms': round(self.max_ms, 1),
+            }
+
+
+_lock = threading.Lock()
+_sessions = {}
+host_stats = {}
+
+
+def _stats(host):
+    with _lock:
+        return host_stats.setdefault(host, HostStats())
+
+
+def _session(host):
+    with _lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def _retry_after(response):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    return float(retry_after) if retry_after and retry_after.isdigit() else None
+
+
+def _rate_limited(upstream, host, response, last_attempt):
+    # A 429 pauses the upstream's bucket for every worker; after the last attempt the caller gets RateLimited
+    ratelimit.throttle(upstream or host, _retry_after(response) or settings.HTTP_BACKOFF_BASE)
+    if last_attempt:
+        raise ratelimit.RateLimited(f"{upstream or host} answered 429 Too Many Requests")
+
+
+def check_status(response, upstream):
+    # A non-2xx answer is an upstream failure, not an empty result: callers fall back to stored data
+    # or report the part as missing
+    if not 200 <= response.status_code < 300:
+        raise UpstreamUnavailable(f"{upstream} answered {response.status_code}")
+    return response
+
+
+def _record(upstream, elapsed_ms, status, size=0):
+    metrics.request_seconds.observe(elapsed_ms / 1000, upstream)
+    metrics.requests_total.inc(upstream, status)
+    if size:
+        metrics.response_bytes.inc(upstream, amount=size)
+
+
+def _record_completion(elapsed_ms, response=None, error=None):
+    status = '200' if error is None else str(getattr(error, 'status_code', None) or 'error')
+    _record('openai', elapsed_ms, status)
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        metrics.llm_tokens.inc('prompt', amount=usage.prompt_tokens or 0)
+        metrics.llm_tokens.inc('completion', amount=usage.completion_tokens or 0)
+
+
+def _backoff(attempt, response=None):
+    retry_after = _retry_after(response)
+    if retry_after is not None:
+        return min(retry_after, settings.HTTP_BACKOFF_MAX)
+    # Full jitter, so retries from many workers don't line up
+    return random.uniform(0, min(settings.HTTP_BACKOFF_MAX, settings.HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+def get(url, params=None, timeout=None, retries=None, upstream=None):
+    host = urlsplit(url).netloc
+    session, stats = _session(host), _stats(host)
+    breaker = breaker_for(upstream or host)
+    timeout = timeout or (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+    attempts = 1 + (settings.HTTP_MAX_RETRIES if retries is None else retries)
+
+    for attempt in range(attempts):
+        # Raises UpstreamUnavailable straight away while the upstream's breaker is open. The
+        # half-open probe is only taken (breaker.call) once a token is held, so it goes out.
+        breaker.check()
+        ratelimit.acquire(upstream)
+        response = None
+        with breaker.call() as call:
+            started = time.monotonic()
+            try:
+                response = session.get(url, params=params, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                elapsed_ms = (time.monotonic() - started) * 1000
+                stats.record(elapsed_ms, error=True)
+                _record(upstream or host, elapsed_ms, 'error')
+                call.record(False, elapsed_ms)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                elapsed_ms = (time.monotonic() - started) * 1000
+                stats.record(elapsed_ms, error=response.status_code >= 500)
+                _record(upstream or host, elapsed_ms, str(response.status_code), len(response.content))
+                call.record(response.status_code < 400, elapsed_ms)
+                if response.status_code == 429:
+                    _rate_limited(upstream, host, response, attempt == attempts - 1)
+                if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                    return response
+
+        stats.record_retry()
+        metrics.retries_total.inc(upstream or host)
+        time.sleep(_backoff(attempt, response))
+
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    if settings.OPENAI_STUB:
+        return RecordedOpenAI(latency=settings.OPENAI_STUB_LATENCY)
+    return openai.OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        base_url=settings.OPENAI_BASE_URL,
+        timeout=settings.OPENAI_TIMEOUT,
+        max_retries=settings.HTTP_MAX_RETRIES,
+    )
+
+
+def chat_completion(**kwargs):
+    client = get_openai_client()
+    stats = _stats(client.base_url.host)
+    breaker = breaker_for('openai')
+    breaker.check()
+    ratelimit.acquire('openai')
+    with breaker.call() as call:
+        started = time.monotonic()
+        try:
+            response = client.chat.completions.create(**kwargs)
+        except openai.OpenAIError as error:
+            elapsed_ms = (time.monotonic() - started) * 1000
+            stats.record(elapsed_ms, error=True)
+            call.record(False, elapsed_ms)
+            _record_completion(elapsed_ms, error=error)
+            if isinstance(error, openai.RateLimitError):
+                _rate_limited('openai', 'openai', error.response, True)
+            raise
+        elapsed_ms = (time.monotonic() - started) * 1000
+        stats.record(elapsed_ms)
+        call.record(True, elapsed_ms)
+    _record_completion(elapsed_ms, response)
+    return response
+
+
+_async_clients = WeakKeyDictionary()
+_async_openai_clients = WeakKeyDictionary()
+
+
+def _async_client():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.HTTP_READ_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_POOL_SIZE,
+            ),
+        )
+    return _async_clients[loop]
+
+
+async def aget(url, params=None, retries=None, upstream=None):
+    host = urlsplit(url).netloc
+    client, stats = _async_client(), _stats(host)
+    breaker = breaker_for(upstream or host)
+    attempts = 1 + (settings.HTTP_MAX_RETRIES if retries is None else retries)
+
+    for attempt in range(attempts):
+        breaker.check()
+        await ratelimit.aacquire(upstream)
+        response = None
+        with breaker.call() as call:
+            started = time.monotonic()
+            try:
+                response = await client.get(url, params=params)
+            except httpx.TransportError:
+                elapsed_ms = (time.monotonic() - started) * 1000
+                stats.record(elapsed_ms, error=True)
+                _record(upstream or host, elapsed_ms, 'error')
+                call.record(False, elapsed_ms)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                elapsed_ms = (time.monotonic() - started) * 1000
+                stats.record(elapsed_ms, error=response.status_code >= 500)
+                _record(upstream or host, elapsed_ms, str(response.status_code), len(response.content))
+                call.record(response.status_code < 400, elapsed_ms)
+                if response.status_code == 429:
+                    _rate_limited(upstream, host, response, attempt == attempts - 1)
+                if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                    return response
+
+        stats.record_retry()
+        metrics.retries_total.inc(upstream or host)
+        await asyncio.sleep(_backoff(attempt, response))
+
+
+def get_async_openai_client():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_openai_clients:
+        if settings.OPENAI_STUB:
+            _async_openai_clients[loop] = AsyncRecordedOpenAI(latency=settings.OPENAI_STUB_LATENCY)
+        else:
+            _async_openai_clients[loop] = openai.AsyncOpenAI(
+                api_key=os.getenv('OPENAI_API_KEY'),
+                base_url=settings.OPENAI_BASE_URL,
+                timeout=settings.OPENAI_TIMEOUT,
+                max_retries=settings.HTTP_MAX_RETRIES,
+            )
+    return _async_openai_clients[loop]
+
+
+async def achat_completion(**kwargs):
+    client = get_async_openai_client()
+    stats = _stats(client.base_url.host)
+    breaker = breaker_for('openai')
+    breaker.check()
+    await ratelimit.aacquire('openai')
+    with breaker.call() as call:
+        started = time.monotonic()
+        try:
+            response = await client.chat.completions.create(**kwargs)
+        except openai.OpenAIError as error:
+            elapsed_ms = (time.monotonic() - started) * 1000
+            stats.record(elapsed_ms, error=True)
+            call.record(False, elapsed_ms)
+            _record_completion(elapsed_ms, error=error)
+            if isinstance(error, openai.RateLimitError):
+                _rate_limited('openai', 'openai', error.response, True)
+            raise
+        elapsed_ms = (time.monotonic() - started) * 1000
+        stats.record(elapsed_ms)
+        call.record(True, elapsed_ms)
+    _record_completion(elapsed_ms, response)
+    return response
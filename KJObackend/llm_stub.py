@@ -0,0 +1,62 @@
+# KJObackend/llm_stub.py
+#
+# Local stand-in for the OpenAI client, used when OPENAI_STUB is set (tests, demos,
+# benchmarks) so nothing is sent to the API. Country code prompts, single or batched,
+# are answered from a recording of real completions and then from the gazetteer;
+# any other prompt gets a fixed weather summary.
+import asyncio
+import json
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from .gazetteer import DATA_DIR, gazetteer
+
+RECORDING_PATH = DATA_DIR / 'recorded' / 'openai_country_code.json'
+STUB_SUMMARY = "Mild and mostly dry; pack a light jacket for the evenings."
+
+
+def load_recording(path=RECORDING_PATH):
+    return json.loads(Path(path).read_text())['responses']
+
+
+def _completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class RecordedOpenAI:
+    # Replays recorded chat completions after a fixed delay
+    def __init__(self, responses=None, latency=0.0):
+        self.responses = load_recording() if responses is None else responses
+        self.latency = latency
+        self.base_url = SimpleNamespace(host='recorded-stub')
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.calls = 0
+
+    def answer(self, messages):
+        self.calls += 1
+        prompt = messages[-1]['content']
+        if 'Cities: ' in prompt:
+            city_names = json.loads(prompt.rsplit('Cities: ', 1)[-1])
+            return json.dumps({'country_codes': [self.country_code(city_name) or False for city_name in city_names]})
+        if 'City: ' in prompt:
+            city_name = prompt.rsplit('City: ', 1)[-1]
+            if city_name in self.responses:
+                return self.responses[city_name]
+            return json.dumps({'country_code': self.country_code(city_name) or False})
+        return STUB_SUMMARY
+
+    def country_code(self, city_name):
+        if city_name in self.responses:
+            return json.loads(self.responses[city_name]).get('country_code')
+        return gazetteer.country_code(city_name)
+
+    def create(self, model, messages, **kwargs):
+        time.sleep(self.latency)
+        return _completion(self.answer(messages))
+
+
+class AsyncRecordedOpenAI(RecordedOpenAI):
+    async def create(self, model, messages, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _completion(self.answer(messages))
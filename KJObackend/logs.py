@@ -0,0 +1,103 @@
+# KJObackend/logs.py
+#
+# JSON logging that stays off the request path. QueueLogHandler only copies the record
+# onto a bounded queue (dropping it when the queue is full); a listener thread per
+# process formats it as one JSON line and writes it to stdout. Records carry the id of
+# the request they were logged in (set by RequestIdMiddleware). A 'payload' passed in
+# extra is kept whole when small and otherwise only in a sample of records.
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueListener
+
+from django.conf import settings
+
+from . import metrics
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+dropped = metrics.Counter('log_records_dropped_total', "Log records dropped because the log queue was full")
+
+# Attributes every LogRecord has; anything else came in through extra
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = self.sample_payload(value) if key == 'payload' else value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+    @staticmethod
+    def sample_payload(payload):
+        text = json.dumps(payload, default=str)
+        if len(text) <= settings.LOG_PAYLOAD_MAX_BYTES or random.random() < settings.LOG_PAYLOAD_SAMPLE_RATE:
+            return payload
+        return {'omitted_bytes': len(text)}
+
+
+class QueueLogHandler(logging.Handler):
+    # Starts its listener on first use in each process, so forked workers get their own thread
+    def __init__(self, stream=None):
+        super().__init__()
+        self.stream = stream or sys.stdout
+        self.queue = None
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            output = logging.StreamHandler(self.stream)
+            output.setFormatter(JsonFormatter())
+            self.queue = queue.Queue(settings.LOG_QUEUE_SIZE)
+            self.listener = QueueListener(self.queue, output)
+            self.listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.listener.stop)
+
+    def prepare(self, record):
+        # Done here while the arguments are still what they were when logged;
+        # the payload is sized and serialized by the listener
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            dropped.inc()
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,59 @@
+import statistics
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+
+from KJObackend import external_apis, http_client
+from KJObackend.gazetteer import Gazetteer
+from KJObackend.llm_stub import RECORDING_PATH, RecordedOpenAI, load_recording
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = "Compare gazetteer country code lookups with the LLM path replayed from a recorded stub"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recording', default=RECORDING_PATH)
+        parser.add_argument('--llm-latency', type=float, default=0.5, help="Seconds the stub waits per completion")
+        parser.add_argument('--rounds', type=int, default=1000, help="Gazetteer lookups per city")
+
+    def handle(self, *args, **options):
+        responses = load_recording(options['recording'])
+        cities = list(responses)
+
+        index = Gazetteer()
+        started = time.perf_counter()
+        index.lookup(cities[0])
+        cold_ms = (time.perf_counter() - started) * 1000
+
+        index_samples = []
+        for city_name in cities:
+            for _ in range(options['rounds']):
+                started = time.perf_counter()
+                index.country_code(city_name)
+                index_samples.append((time.perf_counter() - started) * 1e6)
+
+        llm_samples = []
+        llm_codes = {}
+        stub = RecordedOpenAI(responses, options['llm_latency'])
+        with mock.patch.object(http_client, 'get_openai_client', lambda: stub):
+            for city_name in cities:
+                started = time.perf_counter()
+                llm_codes[city_name] = external_apis.get_country_code_from_llm(city_name, max_attempts=1)
+                llm_samples.append((time.perf_counter() - started) * 1e6)
+
+        known = [city_name for city_name in cities if index.country_code(city_name)]
+        agree = sum(index.country_code(city_name) == llm_codes[city_name] for city_name in known)
+
+        self.stdout.write(f"Cities: {len(cities)}, known to the gazetteer: {len(known)}, same answer as the LLM: {agree}")
+        self.stdout.write(f"Gazetteer first lookup (maps the index): {cold_ms:.3f} ms")
+        for label, samples in (("Gazetteer", index_samples), ("LLM (recorded stub)", llm_samples)):
+            self.stdout.write(
+                f"{label:<20} p50 {percentile(samples, 0.5):>12.1f} us   "
+                f"p99 {percentile(samples, 0.99):>12.1f} us   mean {statistics.fmean(samples):>12.1f} us"
+            )
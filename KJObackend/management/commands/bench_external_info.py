@@ -0,0 +1,113 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from KJObackend.management.commands.bench_country_code import percentile
+from KJObackend.models import Trip, DestinationResolution, ExternalInfoSnapshot, TicketmasterDay, WeatherDay, WeatherSummary
+
+DESTINATIONS = ['Oslo', 'Bergen', 'Paris', 'London', 'Rome', 'Milan', 'Barcelona', 'Berlin', 'Amsterdam', 'Copenhagen', 'Stockholm', 'Lisbon']
+ENDPOINTS = {
+    'live': 'trips/{id}/external_info/live/',
+    'stream': 'trips/{id}/external_info/stream/',
+    'snapshot': 'trips/{id}/external_info/',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test an external info endpoint of a running server (point it at standin_upstreams) and "
+        "report p50/p99 latency with cold and then warm caches. Cold runs delete the stored upstream "
+        "data (destinations, weather, events, summaries, snapshots), so use a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api')
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='live')
+        parser.add_argument('--trips', type=int, default=len(DESTINATIONS), help="Benchmark trips (one destination each, reused between runs)")
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=200, help="Requests per pass")
+        parser.add_argument('--passes', default='cold,warm', help="Comma-separated passes to run, in order")
+
+    def handle(self, *args, **options):
+        token, trips = self.bench_trips(options['trips'])
+        paths = [ENDPOINTS[options['endpoint']].format(id=trip.id) for trip in trips]
+
+        for name in options['passes'].split(','):
+            if name == 'cold':
+                self.clear_caches()
+            samples, first_bytes, errors, elapsed = self.run_pass(
+                options['url'].rstrip('/'), token, paths, options['concurrency'], options['requests']
+            )
+            self.report(name, samples, first_bytes, errors, elapsed)
+
+    def bench_trips(self, count):
+        user, created = get_user_model().objects.get_or_create(username='bench')
+        if created:
+            user.set_unusable_password()
+            user.save()
+        token, _ = Token.objects.get_or_create(user=user)
+
+        trips = list(Trip.objects.filter(owner=user).order_by('id')[:count])
+        start = timezone.localdate() + timedelta(days=1)
+        for i in range(len(trips), count):
+            trips.append(Trip.objects.create(
+                owner=user,
+                name=f"Benchmark trip {i + 1}",
+                destination=DESTINATIONS[i % len(DESTINATIONS)],
+                start_date=start,
+                end_date=start + timedelta(days=2 + i % 3),
+            ))
+        return token.key, trips
+
+    def clear_caches(self):
+        for model in (DestinationResolution, WeatherDay, TicketmasterDay, WeatherSummary, ExternalInfoSnapshot):
+            model.objects.all().delete()
+
+    def run_pass(self, base_url, token, paths, concurrency, count):
+        local = threading.local()
+
+        def call(i):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.headers['Authorization'] = f"Token {token}"
+            started = time.perf_counter()
+            try:
+                with local.session.get(f"{base_url}/{paths[i % len(paths)]}", stream=True, timeout=120) as response:
+                    first_byte = None
+                    for _ in response.iter_content(chunk_size=None):
+                        if first_byte is None:
+                            first_byte = (time.perf_counter() - started) * 1000
+                    ok = response.status_code == 200
+            except requests.RequestException:
+                ok, first_byte = False, None
+            return (time.perf_counter() - started) * 1000, first_byte, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(call, range(count)))
+        elapsed = time.perf_counter() - started
+
+        samples = [ms for ms, _, ok in results if ok]
+        first_bytes = [first_byte for _, first_byte, ok in results if ok and first_byte is not None]
+        errors = sum(not ok for _, _, ok in results)
+        return samples, first_bytes, errors, elapsed
+
+    def report(self, name, samples, first_bytes, errors, elapsed):
+        total = len(samples) + errors
+        self.stdout.write(self.style.SUCCESS(
+            f"{name}: {total} request(s) in {elapsed:.1f}s ({total / elapsed:.1f}/s), {errors} error(s)"
+        ))
+        for label, values in (("total", samples), ("first byte", first_bytes)):
+            if values:
+                self.stdout.write(
+                    f"  {label:<10} p50 {percentile(values, 0.5):>9.1f} ms   p99 {percentile(values, 0.99):>9.1f} ms   "
+                    f"mean {statistics.fmean(values):>9.1f} ms   max {max(values):>9.1f} ms"
+                )
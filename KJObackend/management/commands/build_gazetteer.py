@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from KJObackend.gazetteer import SOURCE_PATH, INDEX_PATH, build_index
+
+
+class Command(BaseCommand):
+    help = "Compile the bundled city dataset into the sorted index used for country code lookups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=SOURCE_PATH, help="CSV with name,country_code,population columns")
+        parser.add_argument('--target', default=INDEX_PATH)
+
+    def handle(self, *args, **options):
+        count = build_index(options['source'], options['target'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} cities to {options['target']}"))
@@ -0,0 +1,100 @@
+import re
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from KJObackend.models import (
+    Trip, Participant, Event, Expense, Task, DestinationResolution, ExternalInfoSnapshot, TicketmasterDay, WeatherDay,
+    WeatherSummary,
+)
+from KJObackend.pagination import keyset_filter, keyset_order
+from KJObackend.sample_data import sample_trip
+from KJObackend.serializers import TripSummarySerializer
+
+User = get_user_model()
+
+# How each backend reports a full table scan, and an index being used
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (\w+)(?! USING)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+}
+INDEX_USED = {
+    'sqlite': re.compile(r'USING (?:COVERING )?INDEX (\w+)|USING (INTEGER PRIMARY KEY)'),
+    'postgresql': re.compile(r'Index (?:Only )?Scan(?: Backward)? using (\w+)|Bitmap Index Scan on (\w+)'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the hot queries (trip lists, per-trip rows, membership checks, stored upstream data) "
+        "and fail if any of them scans a whole table. Builds sample data in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every plan in full")
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in FULL_SCAN:
+            raise CommandError(f"Don't know how to read {vendor} plans (sqlite and postgresql are supported)")
+
+        with transaction.atomic():
+            if vendor == 'postgresql':
+                # The sample tables are tiny, so the planner would rightly prefer sequential scans
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            plans = [(label, queryset.explain()) for label, queryset in self.hot_queries()]
+            transaction.set_rollback(True)
+
+        tables = {model._meta.db_table for model in apps.get_app_config('KJObackend').get_models()}
+        tables.add(User._meta.db_table)
+        failed = []
+        for label, plan in plans:
+            scanned = sorted({table for table in FULL_SCAN[vendor].findall(plan) if table in tables})
+            indexes = sorted({name for match in INDEX_USED[vendor].findall(plan) for name in match if name})
+            if scanned:
+                failed.append(label)
+                self.stdout.write(self.style.ERROR(f"{label:<32} full scan of {', '.join(scanned)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{label:<32} {', '.join(indexes)}"))
+            if options['verbose_plans'] or scanned:
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+        if failed:
+            raise CommandError(f"{len(failed)} hot quer{'y' if len(failed) == 1 else 'ies'} without an index")
+
+    def hot_queries(self):
+        user = User.objects.create(username='query-plan-check')
+        friends = [User.objects.create(username=f"query-plan-check-{i}") for i in range(3)]
+        trips = [sample_trip(user, friends, i) for i in range(3)]
+        trip = trips[0]
+        today = timezone.localdate()
+        mine = Trip.objects.filter(participants=user)
+        open_tasks = Task.objects.exclude(status=Task.Status.DONE)
+
+        return [
+            ("trips of a user", mine.order_by('start_date')),
+            ("future trips of a user", mine.filter(start_date__gte=today).order_by('start_date')),
+            ("past trips of a user", mine.filter(end_date__lt=today).order_by('start_date')),
+            ("trip summaries", TripSummarySerializer.setup_eager_loading(mine, user=user)),
+            ("trips page after cursor", mine.filter(keyset_filter(Trip, ('start_date', 'id'), [trip.start_date, trip.id], True))
+                .order_by(*keyset_order(Trip, ('start_date', 'id'), True))[:50]),
+            ("participant check", trip.participants.filter(id=user.id)),
+            ("participants of a trip", Participant.objects.filter(trip=trip)),
+            ("events of a trip", Event.objects.filter(trip_id=trip.id)),
+            ("events page", Event.objects.filter(trip_id=trip.id).order_by(*keyset_order(Event, ('date', 'id'), True))[:50]),
+            ("expenses of a trip", Expense.objects.filter(trip=trip)),
+            ("tasks of a trip", Task.objects.filter(trip=trip)),
+            ("open tasks of a trip", open_tasks.filter(trip=trip)),
+            ("user's open tasks", open_tasks.filter(trip__in=trips, responsible__user=user)),
+            ("upcoming trips (prefetch)", Trip.objects.filter(start_date__lte=today + timedelta(days=7), end_date__gte=today)),
+            ("snapshot of a trip", ExternalInfoSnapshot.objects.filter(trip=trip)),
+            ("stored destinations", DestinationResolution.objects.filter(destination_key__in=['oslo', 'paris'])),
+            ("stored forecast days", WeatherDay.objects.filter(cell_key='59.9:10.8', day__range=(today, today + timedelta(days=4)))),
+            ("stored event days", TicketmasterDay.objects.filter(
+                city_key='oslo', country_code='NO', day__range=(today, today + timedelta(days=4)))),
+            ("weather summary", WeatherSummary.objects.filter(key='0' * 64)),
+        ]
@@ -0,0 +1,81 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from KJObackend import ratelimit
+from KJObackend.models import Trip
+from KJObackend.snapshots import refresh_snapshot
+
+
+def refresh(trip, deadline):
+    try:
+        # Yields to interactive requests for the upstream rate limits
+        with ratelimit.priority(ratelimit.BACKGROUND):
+            return refresh_snapshot(trip, deadline)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Refresh weather, events and summaries for trips starting within the next N days, ahead of time"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.PREFETCH_DAYS)
+        parser.add_argument('--workers', type=int, default=settings.PREFETCH_WORKERS)
+        parser.add_argument('--interval', type=int, default=0, help="Seconds between cycles; 0 runs one cycle and exits")
+        parser.add_argument('--deadline', type=float, default=settings.PREFETCH_DEADLINE, help="Seconds allowed per trip")
+        parser.add_argument('--budget', action='append', default=[], metavar='UPSTREAM=PER_MINUTE',
+                            help="Override a rate budget, e.g. --budget openai=30 (0 removes the limit)")
+
+    def handle(self, *args, **options):
+        budgets = dict(settings.PREFETCH_RATE_BUDGETS)
+        for override in options['budget']:
+            upstream, _, per_minute = override.partition('=')
+            if not per_minute.isdigit():
+                raise CommandError(f"Invalid budget '{override}', expected UPSTREAM=PER_MINUTE")
+            budgets[upstream] = int(per_minute)
+        for upstream, per_minute in budgets.items():
+            ratelimit.set_budget(upstream, per_minute)
+
+        while True:
+            self.run_cycle(options['days'], options['workers'], options['deadline'])
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def run_cycle(self, days, workers, deadline):
+        today = timezone.localdate()
+        trips = list(
+            Trip.objects.filter(start_date__lte=today + timedelta(days=days), end_date__gte=today).order_by('start_date')
+        )
+        counts = {'complete': 0, 'partial': 0, 'failed': 0}
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') as pool:
+            futures = {pool.submit(refresh, trip, deadline): trip for trip in trips}
+            for done, future in enumerate(as_completed(futures), start=1):
+                trip = futures[future]
+                try:
+                    snapshot = future.result()
+                except Exception as error:
+                    counts['failed'] += 1
+                    self.stderr.write(f"Trip {trip.id} ({trip.destination}): {error!r}")
+                else:
+                    counts['partial' if snapshot.payload.get('missing') else 'complete'] += 1
+
+                if done % 10 == 0 or done == len(trips):
+                    self.stdout.write(f"  {done}/{len(trips)} trips")
+
+        elapsed = time.monotonic() - started
+        rate = len(trips) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Prefetched {len(trips)} trip(s) in {elapsed:.1f}s ({rate:.2f} trips/s): "
+            f"{counts['complete']} complete, {counts['partial']} partial, {counts['failed']} failed"
+        ))
+        for upstream, budget in sorted(ratelimit.budgets.items()):
+            self.stdout.write(f"  {upstream}: {budget.granted} call(s), {budget.waited:.1f}s waiting for budget (limit {budget.per_minute}/min)")
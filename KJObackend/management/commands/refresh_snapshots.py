@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from KJObackend import ratelimit
+from KJObackend.models import Trip
+from KJObackend.snapshots import refresh_snapshot
+
+
+class Command(BaseCommand):
+    help = "Recompute external info snapshots that are missing or older than SNAPSHOT_MAX_AGE (run it from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Refresh every trip, not just stale ones")
+        parser.add_argument('--include-past', action='store_true', help="Also refresh trips that have already ended")
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.all()
+        if not options['include_past']:
+            trips = trips.filter(end_date__gte=timezone.localdate())
+        if not options['all']:
+            stale_before = timezone.now() - timedelta(seconds=settings.SNAPSHOT_MAX_AGE)
+            trips = trips.filter(
+                Q(external_info_snapshot__isnull=True) | Q(external_info_snapshot__computed_at__lt=stale_before)
+            )
+
+        refreshed = 0
+        for trip in trips.order_by('start_date'):
+            with ratelimit.priority(ratelimit.BACKGROUND):
+                refresh_snapshot(trip)
+            refreshed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {refreshed} snapshot(s)"))
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from django.core.management.base import BaseCommand
+
+from KJObackend.gazetteer import DATA_DIR
+from KJObackend.llm_stub import RecordedOpenAI
+
+FIXTURES_PATH = DATA_DIR / 'recorded' / 'upstreams.json'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers like OpenWeather (geocode, forecast), Ticketmaster (discovery events) and
+    OpenAI (chat completions), replaying the recorded responses in FIXTURES_PATH.
+    Responses are delayed and errors injected according to the server's options.
+    """
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        routes = {
+            '/geo/1.0/direct': self.geocode,
+            '/data/2.5/forecast': self.forecast,
+            '/discovery/v2/events.json': self.events,
+        }
+        route = routes.get(url.path)
+        if route is None:
+            return self.reply(404, {'message': 'not found'})
+        self.respond(self.server.latency, lambda: route(params))
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self.reply(404, {'error': {'message': 'not found'}})
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        self.respond(self.server.llm_latency, lambda: self.chat_completion(body))
+
+    def respond(self, latency, build):
+        server = self.server
+        time.sleep(latency * random.uniform(1 - server.jitter, 1 + server.jitter))
+        roll = random.random()
+        if roll < server.error_rate:
+            return self.reply(503, {'message': 'injected error'})
+        if roll < server.error_rate + server.throttle_rate:
+            return self.reply(429, {'message': 'injected rate limit'}, {'Retry-After': '1'})
+        self.reply(200, build())
+
+    def reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def geocode(self, params):
+        query = params.get('q', '')
+        if query in self.server.fixtures['geocode']:
+            return self.server.fixtures['geocode'][query]
+        # Unrecorded places get a stable made-up location
+        city_name, _, country_code = query.partition(',')
+        digest = hashlib.sha1(query.encode()).digest()
+        return [{
+            'name': city_name,
+            'lat': round(digest[0] / 255 * 120 - 50, 4),
+            'lon': round(digest[1] / 255 * 340 - 170, 4),
+            'country': country_code,
+        }]
+
+    def forecast(self, params):
+        # The recorded forecast, moved so that it starts at the current 3-hour slot
+        recorded = self.server.fixtures['forecast']
+        slot = int(time.time()) // 10800 * 10800
+        shift = slot - recorded['list'][0]['dt']
+        entries = [{**entry, 'dt': entry['dt'] + shift} for entry in recorded['list']]
+        city = {**recorded['city'], 'sunrise': recorded['city']['sunrise'] + shift, 'sunset': recorded['city']['sunset'] + shift}
+        return {**recorded, 'list': entries, 'city': city}
+
+    def events(self, params):
+        # The recorded events, repeated for every day of the requested window
+        templates = self.server.fixtures['ticketmaster_events']
+        start = datetime.strptime(params['startDateTime'][:10], '%Y-%m-%d').date()
+        end = datetime.strptime(params['endDateTime'][:10], '%Y-%m-%d').date()
+        size, page = int(params.get('size', 20)), int(params.get('page', 0))
+
+        total = ((end - start).days + 1) * self.server.events_per_day
+        events = []
+        for index in range(page * size, min((page + 1) * size, total)):
+            day = start + timedelta(days=index // self.server.events_per_day)
+            template = templates[index % len(templates)]
+            start_info = {**template['dates']['start'], 'localDate': str(day)}
+            events.append({
+                **template,
+                'id': f"{template['id']}-{day:%Y%m%d}-{index}",
+                'dates': {**template['dates'], 'start': start_info},
+            })
+
+        data = {'page': {'size': size, 'totalElements': total, 'totalPages': -(-total // size), 'number': page}}
+        if events:
+            data['_embedded'] = {'events': events}
+        return data
+
+    def chat_completion(self, body):
+        return {
+            'id': f"chatcmpl-standin-{random.getrandbits(32):08x}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'gpt-4o-mini'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.server.llm.answer(body.get('messages', []))},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        }
+
+
+class Command(BaseCommand):
+    help = "Serve recorded OpenWeather, Ticketmaster and OpenAI responses locally, for load tests without real quota"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--fixtures', default=FIXTURES_PATH)
+        parser.add_argument('--latency', type=float, default=120, help="Milliseconds per OpenWeather/Ticketmaster response")
+        parser.add_argument('--llm-latency', type=float, default=800, help="Milliseconds per chat completion")
+        parser.add_argument('--jitter', type=float, default=0.3, help="Latencies vary by up to this fraction either way")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of responses that are 503s")
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of responses that are 429s")
+        parser.add_argument('--events-per-day', type=int, default=8)
+        parser.add_argument('--verbose', action='store_true', help="Log every request")
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer((options['host'], options['port']), StandInHandler)
+        server.daemon_threads = True
+        server.fixtures = json.loads(Path(options['fixtures']).read_text())
+        server.latency = options['latency'] / 1000
+        server.llm_latency = options['llm_latency'] / 1000
+        server.jitter = min(max(options['jitter'], 0), 1)
+        server.error_rate = options['error_rate']
+        server.throttle_rate = options['throttle_rate']
+        server.events_per_day = options['events_per_day']
+        server.verbose = options['verbose']
+        server.llm = RecordedOpenAI()
+
+        base = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(self.style.SUCCESS(f"Stand-in upstreams on {base}"))
+        self.stdout.write(f"  OPENWEATHER_BASE_URL={base} TICKETMASTER_BASE_URL={base} OPENAI_BASE_URL={base}/v1")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
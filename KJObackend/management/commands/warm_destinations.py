@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from KJObackend.destinations import warm_destinations
+from KJObackend.models import Trip
+
+
+class Command(BaseCommand):
+    help = "Resolve country code and coordinates for trip destinations that are not stored yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('destinations', nargs='*', help="Destinations to resolve (default: every trip's destination)")
+        parser.add_argument('--batch-size', type=int, help="Unknown destinations sent to the LLM per completion (default: COUNTRY_CODE_BATCH_SIZE)")
+
+    def handle(self, *args, **options):
+        names = options['destinations'] or Trip.objects.values_list('destination', flat=True).distinct()
+        resolved, failed = warm_destinations(names, options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f"Resolved {len(resolved)} destination(s)"))
+        for name in failed:
+            self.stdout.write(self.style.WARNING(f"Could not resolve: {name}"))
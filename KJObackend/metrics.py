@@ -0,0 +1,190 @@
+# KJObackend/metrics.py
+#
+# Process-wide counters and histograms in the Prometheus text format, served by
+# /metrics. Every thread records into its own shard, so recording takes no lock; the
+# shards are only summed when the endpoint is scraped. A thread's shard is folded into
+# the totals once the thread is gone (the upstream steps run in short-lived threads).
+# Histograms have fixed buckets, so an observation is a bisect and an increment.
+import functools
+import inspect
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+PREFIX = 'travelplanner_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+_collectors = []
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+        _registry.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._shards.remove(shard)
+            self._merge(self._retired, shard)
+
+    def _totals(self):
+        with self._lock:
+            totals = {}
+            self._merge(totals, self._retired)
+            for shard in self._shards:
+                # dict.copy() doesn't let the owning thread in halfway through
+                self._merge(totals, shard.copy())
+        return totals
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in shard.items():
+            into[key] = into.get(key, 0) + value
+
+    def samples(self):
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in sorted(self._totals().items())]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        shard = self._shard()
+        counts = shard.get(label_values)
+        if counts is None:
+            # one count per bucket, then +Inf, then the sum
+            counts = shard[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, counts in shard.items():
+            counts = list(counts)
+            if key in into:
+                into[key] = [a + b for a, b in zip(into[key], counts)]
+            else:
+                into[key] = counts
+
+    def samples(self):
+        samples = []
+        for key, counts in sorted(self._totals().items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, 'le': _format(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+def register_collector(collect):
+    # collect() returns [(name, type, help, [(labels, value), ...])] read from elsewhere at scrape time
+    _collectors.append(collect)
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _line(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f"{name}{{{label_text}}} {_format(value)}"
+    return f"{name} {_format(value)}"
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(_line(*sample) for sample in metric.samples())
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines.append(f"# HELP {PREFIX}{name} {help}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            lines.extend(_line(PREFIX + name, labels, value) for labels, value in samples)
+    return '\n'.join(lines) + '\n'
+
+
+function_seconds = Histogram('upstream_function_seconds', "Time spent in an upstream lookup, including cache hits and coalesced waits", ['function'])
+function_errors = Counter('upstream_function_errors_total', "Upstream lookups that raised", ['function', 'error'])
+request_seconds = Histogram('upstream_request_seconds', "Latency of single HTTP requests to an upstream", ['upstream'])
+requests_total = Counter('upstream_requests_total', "HTTP requests to an upstream by status code ('error' when none came back)", ['upstream', 'status'])
+retries_total = Counter('upstream_retries_total', "Retried upstream requests", ['upstream'])
+response_bytes = Counter('upstream_response_bytes_total', "Response body bytes received from an upstream", ['upstream'])
+llm_tokens = Counter('llm_tokens_total', "Tokens used by chat completions", ['kind'])
+
+
+def instrumented(function):
+    # Decorator recording the latency and errors of an upstream lookup (sync or async)
+    def record(started, error=None):
+        function_seconds.observe(time.perf_counter() - started, function)
+        if error is not None:
+            function_errors.inc(function, type(error).__name__)
+
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as error:
+                    record(started, error)
+                    raise
+                record(started)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                record(started, error)
+                raise
+            record(started)
+            return result
+        return wrapper
+    return decorate
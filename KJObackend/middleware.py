@@ -0,0 +1,59 @@
+# KJObackend/middleware.py
+import logging
+import re
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .logs import request_id
+
+logger = logging.getLogger('KJObackend.requests')
+
+# A caller-supplied X-Request-ID is kept if it looks like an id, so logs line up across services
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class RequestIdMiddleware:
+    # Gives every request a correlation id (logged with each record, echoed in X-Request-ID)
+    # and logs one access line per request
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token, started = self.start(request)
+        try:
+            response = self.get_response(request)
+            return self.finish(request, response, started)
+        finally:
+            request_id.reset(token)
+
+    async def __acall__(self, request):
+        token, started = self.start(request)
+        try:
+            response = await self.get_response(request)
+            return self.finish(request, response, started)
+        finally:
+            request_id.reset(token)
+
+    def start(self, request):
+        incoming = request.headers.get('X-Request-ID', '')
+        request.request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        return request_id.set(request.request_id), time.perf_counter()
+
+    def finish(self, request, response, started):
+        response['X-Request-ID'] = request.request_id
+        logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+        })
+        return response
@@ -0,0 +1,167 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DestinationResolution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destination_key', models.CharField(max_length=100, unique=True)),
+                ('country_code', models.CharField(max_length=2)),
+                ('lat', models.FloatField(blank=True, null=True)),
+                ('lon', models.FloatField(blank=True, null=True)),
+                ('resolved_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WeatherSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('summary', models.TextField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Participant',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='participations', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TicketmasterDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city_key', models.CharField(max_length=100)),
+                ('country_code', models.CharField(max_length=2)),
+                ('day', models.DateField()),
+                ('events', models.JSONField(default=list)),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('city_key', 'country_code', 'day')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('destination', models.CharField(blank=True, default='', max_length=100)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('description', models.TextField(blank=True, default='')),
+                ('owner', models.ForeignKey(default=None, on_delete=django.db.models.deletion.CASCADE, related_name='owned_trips', to=settings.AUTH_USER_MODEL)),
+                ('participants', models.ManyToManyField(default=None, related_name='participating_trips', through='KJObackend.Participant', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField(choices=[(0, 'Requested'), (1, 'In Progress'), (2, 'Done')], default=0)),
+                ('name', models.CharField(max_length=100)),
+                ('description', models.TextField(blank=True, default='')),
+                ('responsible', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='KJObackend.participant')),
+                ('trip', models.ForeignKey(db_index=False, default=0, on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='KJObackend.trip')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='trip',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='trip_participants', to='KJObackend.trip'),
+        ),
+        migrations.CreateModel(
+            name='ExternalInfoSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField(default=dict)),
+                ('destination', models.CharField(blank=True, default='', max_length=100)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='external_info_snapshot', to='KJObackend.trip')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Expense',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('description', models.TextField(blank=True, default='')),
+                ('paid_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paid_expenses', to='KJObackend.participant')),
+                ('shared_between', models.ManyToManyField(related_name='shared_expenses', to='KJObackend.participant')),
+                ('trip', models.ForeignKey(db_index=False, default=0, on_delete=django.db.models.deletion.CASCADE, related_name='expenses', to='KJObackend.trip')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('date', models.DateField(blank=True, default=None, null=True)),
+                ('description', models.TextField(blank=True, default='')),
+                ('trip', models.ForeignKey(db_index=False, default=0, on_delete=django.db.models.deletion.CASCADE, related_name='events', to='KJObackend.trip')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WeatherDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell_key', models.CharField(max_length=40)),
+                ('day', models.DateField()),
+                ('forecast', models.JSONField(default=dict)),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('cell_key', 'day')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['start_date', 'id'], name='trip_start_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['end_date', 'start_date'], name='trip_end_start'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['trip', 'id'], name='task_trip_id'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 2), _negated=True), fields=['trip', 'responsible'], name='task_open_trip_responsible'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['trip', 'id'], name='participant_trip_id'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='participant',
+            unique_together={('user', 'trip')},
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['trip', 'id'], include=('amount',), name='expense_trip_id'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['trip', 'date', 'id'], name='event_trip_date_id'),
+        ),
+    ]
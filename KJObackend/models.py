@@ -27,6 +27,12 @@ class Trip(models.Model):
     )
 
     # Helper functionality
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_date', 'id'], name='trip_start_date_id'), # keyset pagination order, date ranges
+            models.Index(fields=['end_date', 'start_date'], name='trip_end_start'), # trips not over yet (prefetch, refresh)
+        ]
+
     def __str__(self):  
         return self.name
 
@@ -38,18 +44,23 @@ class Participant(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
-        related_name='participations'  
+        related_name='participations',
+        db_index=False # led by the (user, trip) unique index
     )
     
     trip = models.ForeignKey(
         Trip,
         on_delete=models.CASCADE,
-        related_name='trip_participants'  
+        related_name='trip_participants',
+        db_index=False # led by participant_trip_id
     )
     
     # Helper functionality
     class Meta:
         unique_together = ['user', 'trip']
+        indexes = [
+            models.Index(fields=['trip', 'id'], name='participant_trip_id'), # keyset pagination order
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.trip.name}"
@@ -61,9 +72,14 @@ class Event(models.Model):
     description = models.TextField(default="", blank=True)
 
     # Relationships
-    trip = models.ForeignKey(Trip, related_name='events', on_delete=models.CASCADE, default=0) 
+    trip = models.ForeignKey(Trip, related_name='events', on_delete=models.CASCADE, default=0, db_index=False) # led by event_trip_date_id
     
     # Helper functionality
+    class Meta:
+        indexes = [
+            models.Index(fields=['trip', 'date', 'id'], name='event_trip_date_id'), # keyset pagination order
+        ]
+
     def __str__(self):
         return self.name
 
@@ -73,7 +89,7 @@ class Expense(models.Model):
     description = models.TextField(default="", blank=True)
     
     # Relationships
-    trip = models.ForeignKey(Trip, related_name='expenses', on_delete=models.CASCADE, default=0) 
+    trip = models.ForeignKey(Trip, related_name='expenses', on_delete=models.CASCADE, default=0, db_index=False) # led by expense_trip_id
     paid_by = models.ForeignKey(
         Participant,
         on_delete=models.CASCADE,
@@ -86,15 +102,25 @@ class Expense(models.Model):
     )
 
     # Helper functionality
+    class Meta:
+        indexes = [
+            # keyset pagination order; on PostgreSQL it also covers the expense totals of the trip summary.
+            # SQLite ignores include= and warns (models.W040): silenced in settings.py for this index only
+            models.Index(fields=['trip', 'id'], include=['amount'], name='expense_trip_id'),
+        ]
+
     def __str__(self):
         return self.description
 
+# Module level (as Task.Status) so Task.Meta can refer to it
+class TaskStatus(models.IntegerChoices):
+    REQUESTED = 0, 'Requested'
+    IN_PROGRESS = 1, 'In Progress'
+    DONE = 2, 'Done'
+
 class Task(models.Model):
     # Member variables
-    class Status(models.IntegerChoices):
-        REQUESTED = 0, 'Requested'
-        IN_PROGRESS = 1, 'In Progress'
-        DONE = 2, 'Done'
+    Status = TaskStatus
 
     status = models.IntegerField(
         choices=Status.choices,
@@ -104,9 +130,88 @@ class Task(models.Model):
     description = models.TextField(default="", blank=True)
     
     # Relationships
-    trip = models.ForeignKey(Trip, related_name='tasks', on_delete=models.CASCADE, default=0) 
+    trip = models.ForeignKey(Trip, related_name='tasks', on_delete=models.CASCADE, default=0, db_index=False) # led by task_trip_id
     responsible = models.ForeignKey(Participant, related_name='tasks', on_delete=models.CASCADE)
     
     # Helper functionality
+    class Meta:
+        indexes = [
+            models.Index(fields=['trip', 'id'], name='task_trip_id'), # keyset pagination order
+            # open tasks per trip and responsible participant, for the trip summary; partial where the database
+            # supports it, and only used by queries written as exclude(status=Task.Status.DONE)
+            models.Index(fields=['trip', 'responsible'], condition=~models.Q(status=TaskStatus.DONE), name='task_open_trip_responsible'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class DestinationResolution(models.Model):
+    # Member variables
+    destination_key = models.CharField(max_length=100, unique=True) # normalized Trip.destination
+    country_code = models.CharField(max_length=2)
+    lat = models.FloatField(null=True, blank=True)
+    lon = models.FloatField(null=True, blank=True)
+    resolved_at = models.DateTimeField(default=timezone.now)
+
+    # Helper functionality
+    def __str__(self):
+        return f"{self.destination_key} ({self.country_code})"
+
+class WeatherSummary(models.Model):
+    # Member variables
+    key = models.CharField(max_length=64, unique=True) # sha256 of the bucketed forecast inputs
+    summary = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    # Helper functionality
+    def __str__(self):
+        return self.summary[:50]
+
+class TicketmasterDay(models.Model):
+    # Member variables
+    city_key = models.CharField(max_length=100) # normalized city name
+    country_code = models.CharField(max_length=2)
+    day = models.DateField()
+    events = models.JSONField(default=list) # [{'id', 'name', 'date', 'url'}] starting that day
+    fetched_at = models.DateTimeField(default=timezone.now)
+
+    # Helper functionality
+    class Meta:
+        unique_together = ['city_key', 'country_code', 'day']
+
+    def __str__(self):
+        return f"{self.city_key} ({self.country_code}) {self.day}"
+
+class ExternalInfoSnapshot(models.Model):
+    # Member variables
+    payload = models.JSONField(default=dict) # what ExternalInfoAPI returns
+    destination = models.CharField(max_length=100, default="", blank=True) # trip fields the payload was built for
+    start_date = models.DateField()
+    end_date = models.DateField()
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    # Relationships
+    trip = models.OneToOneField(Trip, related_name='external_info_snapshot', on_delete=models.CASCADE)
+
+    # Helper functionality
+    def matches(self, trip):
+        return (self.destination, self.start_date, self.end_date) == (trip.destination, trip.start_date, trip.end_date)
+
+    def __str__(self):
+        return f"{self.trip.name} ({self.computed_at:%Y-%m-%d %H:%M})"
+
+class WeatherDay(models.Model):
+    # Member variables
+    cell_key = models.CharField(max_length=40) # "lat:lon" of the weather grid cell
+    day = models.DateField()
+    forecast = models.JSONField(default=dict) # that day's forecast, folded from the 3-hourly entries
+    fetched_at = models.DateTimeField(default=timezone.now)
+
+    # Helper functionality
+    class Meta:
+        unique_together = ['cell_key', 'day']
+
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f"{self.cell_key} {self.day}"
@@ -0,0 +1,141 @@
+# KJObackend/pagination.py
+#
+# Keyset pagination for the list endpoints. A page is fetched with a WHERE on the
+# view's compound ordering key (e.g. start_date, id) after the last row of the previous
+# page, so every page costs an index seek however deep it is. Cursors are opaque
+# (base64 JSON of the key values). Lists are only paginated when ?cursor= or
+# ?page_size= is given, so existing clients still get plain lists.
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _encode(direction, values):
+    data = json.dumps({'d': direction, 'v': values}, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def _decode(cursor, model, fields):
+    # Returns (direction, key values converted to the fields' types); anything else is an invalid cursor
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        direction, values = data['d'], data['v']
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        values = [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+        raise NotFound("Invalid cursor.")
+    return direction, values
+
+
+def keyset_filter(model, fields, values, forward):
+    # Rows after (forward) or before the key values in (fields) order, with NULLs sorting last
+    condition, same_prefix = Q(pk__in=[]), Q()
+    for field, value in zip(fields, values):
+        nullable = model._meta.get_field(field).null
+        if value is None:
+            further = Q(pk__in=[]) if forward else Q(**{f'{field}__isnull': False})
+            equal = Q(**{f'{field}__isnull': True})
+        else:
+            further = Q(**{f'{field}__gt' if forward else f'{field}__lt': value})
+            if nullable and forward:
+                further |= Q(**{f'{field}__isnull': True})
+            equal = Q(**{field: value})
+        condition |= same_prefix & further
+        same_prefix &= equal
+    return condition
+
+
+def keyset_order(model, fields, forward):
+    # NULLs placement is only spelled out for nullable fields, so the others can use an index as is
+    order = []
+    for field in fields:
+        nullable = model._meta.get_field(field).null
+        if forward:
+            order.append(F(field).asc(nulls_last=True) if nullable else F(field).asc())
+        else:
+            order.append(F(field).desc(nulls_first=True) if nullable else F(field).desc())
+    return order
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def ordering(self, view):
+        return tuple(getattr(view, 'keyset_ordering', ('id',)))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, settings.API_PAGE_SIZE))
+        except ValueError:
+            size = settings.API_PAGE_SIZE
+        return min(max(size, 1), settings.API_MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.fields = self.ordering(view)
+        page_size = self.get_page_size(request)
+        forward, values = True, None
+        if params.get(self.cursor_query_param):
+            direction, values = _decode(params[self.cursor_query_param], queryset.model, self.fields)
+            forward = direction != 'prev'
+
+        queryset = queryset.order_by(*keyset_order(queryset.model, self.fields, forward))
+        if values is not None:
+            queryset = queryset.filter(keyset_filter(queryset.model, self.fields, values, forward))
+
+        # One extra row tells whether there is another page in this direction
+        rows = list(queryset[:page_size + 1])
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        if not forward:
+            rows.reverse()
+
+        # Going back, there is always a next page: the one the cursor came from
+        has_next, has_previous = (more, values is not None) if forward else (True, more)
+        self.next_cursor = self.previous_cursor = None
+        if rows and has_next:
+            self.next_cursor = _encode('next', self.key(rows[-1]))
+        if rows and has_previous:
+            self.previous_cursor = _encode('prev', self.key(rows[0]))
+        return rows
+
+    def key(self, row):
+        return [getattr(row, field) for field in self.fields]
+
+    def link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.link(self.next_cursor),
+            'previous': self.link(self.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,277 @@
+# KJObackend/ratelimit.py
+#
+# Token-bucket rate limits per upstream ('openweather', 'ticketmaster', 'openai'),
+# configured in RATE_LIMITS. The bucket state lives in a file in RATE_LIMIT_DIR, so
+# all workers on this host draw from the same quota. Callers wait in a bounded queue
+# where interactive requests go before background jobs (prefetch, snapshots); a
+# caller that would wait longer than RATE_LIMIT_MAX_WAIT, or finds the queue full,
+# gets RateLimited. Background jobs can also set a stricter budget for their process.
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+from . import metrics
+from .breaker import UpstreamUnavailable
+
+try:
+    import fcntl
+except ImportError:  # Windows: the buckets are per process
+    fcntl = None
+
+INTERACTIVE, BACKGROUND = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+_priority = contextvars.ContextVar('rate_limit_priority', default=INTERACTIVE)
+
+
+class RateLimited(UpstreamUnavailable):
+    pass
+
+
+@contextmanager
+def priority(level):
+    # Calls made inside the block (and in threads started with a copy of this context) queue at this level
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, name, per_minute, burst=1, state_path=None):
+        self.name = name
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.burst = max(burst, 1)
+        self.state_path = state_path
+        self._cond = threading.Condition()
+        self._state = self._full()
+        self._waiting = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self.granted = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def _full(self):
+        return {'tokens': float(self.burst), 'updated': time.time(), 'blocked_until': 0.0}
+
+    def _with_state(self, func):
+        # Runs func on the bucket state, shared through the state file when there is one
+        if self.state_path is None or fcntl is None:
+            return func(self._state)
+        with open(self.state_path, 'a+') as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            state_file.seek(0)
+            try:
+                state = json.loads(state_file.read())
+            except ValueError:
+                state = self._full()
+            result = func(state)
+            state_file.truncate(0)
+            state_file.write(json.dumps(state))
+            return result
+
+    def _refill(self, state, now):
+        state['tokens'] = min(self.burst, state['tokens'] + (now - state['updated']) * self.rate)
+        state['updated'] = now
+
+    def _take(self, state):
+        # Takes a token and returns 0, or returns how many seconds until one is available
+        now = time.time()
+        if now < state['blocked_until']:
+            return state['blocked_until'] - now
+        self._refill(state, now)
+        if state['tokens'] >= 1:
+            state['tokens'] -= 1
+            return 0.0
+        return (1 - state['tokens']) / self.rate
+
+    def _join(self, level):
+        with self._cond:
+            if len(self._waiting) >= settings.RATE_LIMIT_QUEUE:
+                self.rejected += 1
+                raise RateLimited(f"{self.name}: too many calls waiting for the rate limit")
+            entry = (level, next(self._sequence))
+            heapq.heappush(self._waiting, entry)
+            self._cond.notify_all()
+            return entry
+
+    def _leave(self, entry, granted, started):
+        with self._cond:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            self._cond.notify_all()
+            if granted:
+                self.granted += 1
+                self.waited += time.monotonic() - started
+
+    def _turn(self, entry):
+        # 0 once entry holds a token; otherwise seconds to wait (None: not at the head of the queue)
+        if self._waiting[0] != entry:
+            return None
+        return self._with_state(self._take)
+
+    def _give_up(self):
+        with self._cond:
+            self.rejected += 1
+        raise RateLimited(f"{self.name}: rate limit wait would exceed {settings.RATE_LIMIT_MAX_WAIT}s")
+
+    def acquire(self, level=None):
+        level = _priority.get() if level is None else level
+        started = time.monotonic()
+        deadline = started + settings.RATE_LIMIT_MAX_WAIT
+        entry = self._join(level)
+        delay = None
+        try:
+            while True:
+                with self._cond:
+                    delay = self._turn(entry)
+                    remaining = deadline - time.monotonic()
+                    if delay == 0 or remaining <= 0 or (delay is not None and delay > remaining):
+                        break
+                    self._cond.wait(remaining if delay is None else delay)
+        finally:
+            # Always leave the queue, or the callers behind this entry would wait on it forever
+            self._leave(entry, delay == 0, started)
+        if delay != 0:
+            self._give_up()
+
+    async def aacquire(self, level=None):
+        level = _priority.get() if level is None else level
+        started = time.monotonic()
+        deadline = started + settings.RATE_LIMIT_MAX_WAIT
+        entry = self._join(level)
+        delay = None
+        try:
+            while True:
+                with self._cond:
+                    delay = self._turn(entry)
+                remaining = deadline - time.monotonic()
+                if delay == 0 or remaining <= 0 or (delay is not None and delay > remaining):
+                    break
+                # The event loop can't wait on the condition, so a coroutine behind others checks again shortly
+                await asyncio.sleep(min(remaining, 0.01) if delay is None else delay)
+        finally:
+            # Also when cancelled (wait_for deadline, client gone): a dead entry at the head blocks everyone
+            self._leave(entry, delay == 0, started)
+        if delay != 0:
+            self._give_up()
+
+    def throttle(self, seconds):
+        # The upstream answered 429: nobody on this host calls it again for a while
+        def block(state):
+            state['blocked_until'] = max(state['blocked_until'], time.time() + seconds)
+            state['tokens'] = 0.0
+        with self._cond:
+            self._with_state(block)
+            self.throttled += 1
+
+    def snapshot(self):
+        def peek(state):
+            self._refill(state, time.time())
+            return state['tokens'], max(state['blocked_until'] - time.time(), 0)
+
+        with self._cond:
+            tokens, blocked_for = self._with_state(peek)
+            queued = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+            for level, _ in self._waiting:
+                queued[PRIORITY_NAMES.get(level, str(level))] += 1
+            return {
+                'per_minute': self.per_minute,
+                'burst': self.burst,
+                'tokens': round(tokens, 2),
+                'blocked_for': round(blocked_for, 1),
+                'queued': queued,
+                'granted': self.granted,
+                'rejected': self.rejected,
+                'throttled': self.throttled,
+                'avg_wait_ms': round(self.waited / self.granted * 1000, 1) if self.granted else None,
+            }
+
+
+_lock = threading.Lock()
+buckets = {}  # upstream -> bucket shared by the workers on this host
+budgets = {}  # upstream -> stricter per-process budget set by a background job
+
+
+def bucket_for(upstream):
+    if not settings.RATE_LIMITS.get(upstream):
+        return None
+    with _lock:
+        if upstream not in buckets:
+            state_path = None
+            if settings.RATE_LIMIT_DIR:
+                Path(settings.RATE_LIMIT_DIR).mkdir(parents=True, exist_ok=True)
+                state_path = Path(settings.RATE_LIMIT_DIR) / f"{upstream}.json"
+            buckets[upstream] = TokenBucket(upstream, settings.RATE_LIMITS[upstream], settings.RATE_LIMIT_BURST, state_path)
+        return buckets[upstream]
+
+
+def set_budget(upstream, per_minute):
+    with _lock:
+        if per_minute:
+            budgets[upstream] = TokenBucket(f"{upstream} budget", per_minute)
+        else:
+            budgets.pop(upstream, None)
+
+
+def _limits(upstream):
+    return [limit for limit in (budgets.get(upstream), bucket_for(upstream)) if limit is not None]
+
+
+def acquire(upstream):
+    for limit in _limits(upstream):
+        limit.acquire()
+
+
+async def aacquire(upstream):
+    for limit in _limits(upstream):
+        await limit.aacquire()
+
+
+def throttle(upstream, seconds):
+    bucket = bucket_for(upstream)
+    if bucket is not None:
+        bucket.throttle(seconds)
+
+
+def snapshot():
+    return {
+        'buckets': {upstream: bucket.snapshot() for upstream, bucket in buckets.items()},
+        'budgets': {upstream: budget.snapshot() for upstream, budget in budgets.items()},
+    }
+
+
+def collect_metrics():
+    snapshots = {upstream: bucket.snapshot() for upstream, bucket in list(buckets.items())}
+
+    def by_upstream(key):
+        return [({'upstream': upstream}, snapshot[key]) for upstream, snapshot in sorted(snapshots.items())]
+
+    queued = [
+        ({'upstream': upstream, 'priority': level}, count)
+        for upstream, snapshot in sorted(snapshots.items())
+        for level, count in snapshot['queued'].items()
+    ]
+    waited = [({'upstream': upstream}, round(bucket.waited, 3)) for upstream, bucket in sorted(buckets.items())]
+    return [
+        ('rate_limit_tokens', 'gauge', "Tokens left in the shared bucket", by_upstream('tokens')),
+        ('rate_limit_queued', 'gauge', "Calls in this process waiting for a token", queued),
+        ('rate_limit_granted_total', 'counter', "Calls let through by the rate limit", by_upstream('granted')),
+        ('rate_limit_rejected_total', 'counter', "Calls refused by the rate limit (queue full or wait too long)", by_upstream('rejected')),
+        ('rate_limit_throttled_total', 'counter', "429 answers that paused the bucket", by_upstream('throttled')),
+        ('rate_limit_wait_seconds_total', 'counter', "Time spent waiting for tokens", waited),
+    ]
+
+
+metrics.register_collector(collect_metrics)
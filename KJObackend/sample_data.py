@@ -0,0 +1,16 @@
+# KJObackend/sample_data.py
+#
+# Sample rows for the tests and the check_query_plans command.
+from .models import Trip, Participant, Event, Expense, Task
+
+
+def sample_trip(user, friends, index):
+    # A trip of user's with friends along, and a couple of events, expenses and tasks
+    trip = Trip.objects.create(owner=user, name=f"Trip {index}", destination='Oslo', start_date='2030-06-01', end_date='2030-06-05')
+    participants = [Participant.objects.create(user=member, trip=trip) for member in [user, *friends]]
+    for i in range(2):
+        Event.objects.create(trip=trip, name=f"Event {i}")
+        expense = Expense.objects.create(trip=trip, amount=10 + i, description=f"Expense {i}", paid_by=participants[i])
+        expense.shared_between.set(participants[:3])
+        Task.objects.create(trip=trip, name=f"Task {i}", responsible=participants[i + 1])
+    return trip
@@ -1,12 +1,84 @@
 # KJObackend/serializers.py
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Count, DecimalField, F, IntegerField, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
-from .models import Trip, Event, Participant, Expense, Task
+from .models import Trip, Event, Participant, Expense, Task, DestinationResolution
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
-class ParticipantSerializer(serializers.ModelSerializer):
+def _names(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class SparseModelSerializer(serializers.ModelSerializer):
+    # GET ?fields=a,b returns only those fields. Nested relations are left out once ?fields=
+    # or ?expand= is given, unless named in one of them, so ?expand=tasks is every plain
+    # field plus tasks. setup_eager_loading() loads only the columns and relations the
+    # selected fields read; eager_loading() lists the prefetches per nested field.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = self.requested_fields(self.context.get('request'))
+        if wanted is not None:
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+    @classmethod
+    def nested_fields(cls):
+        return {name for name, field in cls._declared_fields.items() if isinstance(field, serializers.BaseSerializer)}
+
+    @classmethod
+    def requested_fields(cls, request):
+        # None means every field
+        if request is None or request.method != 'GET':
+            return None
+        fields, expand = _names(request.query_params.get('fields')), _names(request.query_params.get('expand'))
+        if not fields and not expand:
+            return None
+        available, nested = set(cls.Meta.fields), cls.nested_fields()
+        if fields - available:
+            raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(fields - available))}."})
+        if expand - nested:
+            raise serializers.ValidationError({'expand': f"Not an expandable relation: {', '.join(sorted(expand - nested))}."})
+        return (fields or available - nested) | expand
+
+    @classmethod
+    def eager_loading(cls):
+        return {}
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, columns=()):
+        # columns: loaded even if no selected field reads them (the foreign key a prefetch joins on)
+        fields = set(cls.Meta.fields) if fields is None else fields
+        model = queryset.model
+        only, related = {model._meta.pk.name, *columns}, set()
+        for name in fields:
+            field = cls._declared_fields.get(name)
+            path = (field.source if field is not None and field.source else name).split('.')
+            try:
+                model_field = model._meta.get_field(path[0])
+            except FieldDoesNotExist:
+                continue  # computed or annotated
+            if model_field.many_to_many or model_field.one_to_many:
+                continue  # prefetched through eager_loading()
+            if model_field.is_relation and len(path) > 1:
+                only.add('__'.join(path))
+                related.add('__'.join(path[:-1]))
+            else:
+                only.add(model_field.name)
+
+        queryset = queryset.only(*only)
+        if related:
+            queryset = queryset.select_related(*related)
+        plans = cls.eager_loading()
+        lookups = [lookup for name in sorted(fields) for lookup in plans.get(name, ())]
+        return queryset.prefetch_related(*lookups) if lookups else queryset
+
+
+class ParticipantSerializer(SparseModelSerializer):
     participant_id = serializers.IntegerField(source='id', read_only=True)
     user_id = serializers.PrimaryKeyRelatedField(source='user', read_only=True)
     username = serializers.StringRelatedField(source='user.username')
@@ -15,7 +87,7 @@ class ParticipantSerializer(serializers.ModelSerializer):
         model = Participant
         fields = ['participant_id', 'user_id', 'username']
 
-class TaskSerializer(serializers.ModelSerializer):
+class TaskSerializer(SparseModelSerializer):
     task_id = serializers.IntegerField(source='id', read_only=True)
     trip_id = serializers.PrimaryKeyRelatedField(source='trip', read_only=True)
     responsible = serializers.PrimaryKeyRelatedField(
@@ -34,20 +106,24 @@ class TaskSerializer(serializers.ModelSerializer):
         model = Task
         fields = ['task_id', 'trip_id', 'name', 'description', 'status', 'responsible', 'responsible_id', 'responsible_name']
 
-class EventSerializer(serializers.ModelSerializer):
+class EventSerializer(SparseModelSerializer):
     event_id = serializers.IntegerField(source='id', read_only=True)
     class Meta:
         model = Event
         fields = ['event_id', 'name', 'date', 'description']
 
-class ExpenseSerializer(serializers.ModelSerializer):
+class ExpenseSerializer(SparseModelSerializer):
     expense_id = serializers.IntegerField(source='id', read_only=True)
     trip_id = serializers.PrimaryKeyRelatedField(source='trip', read_only=True)
     class Meta:
         model = Expense
         fields = ['expense_id', 'trip_id', 'amount', 'description', 'paid_by', 'shared_between']
 
-class TripSerializer(serializers.ModelSerializer):
+    @classmethod
+    def eager_loading(cls):
+        return {'shared_between': ['shared_between']}
+
+class TripSerializer(SparseModelSerializer):
     trip_id = serializers.IntegerField(source='id', read_only=True)  # Add this line
     owner = serializers.PrimaryKeyRelatedField(read_only=True)
     owner_username = serializers.StringRelatedField(source='owner.username', read_only=True)
@@ -60,8 +136,69 @@ class TripSerializer(serializers.ModelSerializer):
         model = Trip
         fields = ['trip_id', 'name', 'start_date', 'end_date', 'owner', 'owner_username', 'participants', 'destination', 'description', 'events', 'expenses', 'tasks']
 
+    @classmethod
+    def eager_loading(cls):
+        # Each nested serializer loads its rows with its own plan, plus the trip they belong to
+        return {
+            'participants': [Prefetch('trip_participants', queryset=ParticipantSerializer.setup_eager_loading(Participant.objects.all(), columns=['trip']))],
+            'events': [Prefetch('events', queryset=EventSerializer.setup_eager_loading(Event.objects.all(), columns=['trip']))],
+            'expenses': [Prefetch('expenses', queryset=ExpenseSerializer.setup_eager_loading(Expense.objects.all(), columns=['trip']))],
+            'tasks': [Prefetch('tasks', queryset=TaskSerializer.setup_eager_loading(Task.objects.all(), columns=['trip']))],
+        }
+
+
+def _per_trip(queryset, aggregate, output_field):
+    # Correlated subquery aggregating rows of one trip, so several of them don't multiply each other's joins
+    totals = queryset.filter(trip=OuterRef('pk')).order_by().values('trip').annotate(total=aggregate).values('total')
+    return Coalesce(Subquery(totals, output_field=output_field), Value(output_field.to_python(0)), output_field=output_field)
+
+
+class OpenTaskSerializer(SparseModelSerializer):
+    task_id = serializers.IntegerField(source='id', read_only=True)
+
+    class Meta:
+        model = Task
+        fields = ['task_id', 'name']
 
-class ParticipantCreateSerializer(serializers.ModelSerializer):
+
+class TripSummarySerializer(SparseModelSerializer):
+    # Trip cards for the home page (GET /trips/?view=summary); /trips/<id>/ has everything
+    trip_id = serializers.IntegerField(source='id', read_only=True)
+    owner = serializers.PrimaryKeyRelatedField(read_only=True)
+    owner_username = serializers.CharField(read_only=True)
+    participant_count = serializers.IntegerField(read_only=True)
+    expense_total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    open_task_count = serializers.IntegerField(read_only=True)
+    my_open_tasks = OpenTaskSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Trip
+        fields = ['trip_id', 'name', 'destination', 'start_date', 'end_date', 'owner', 'owner_username',
+                  'participant_count', 'expense_total', 'open_task_count', 'my_open_tasks']
+
+    @classmethod
+    def annotations(cls):
+        open_tasks = Task.objects.exclude(status=Task.Status.DONE)
+        return {
+            'owner_username': F('owner__username'),
+            'participant_count': _per_trip(Participant.objects, Count('id'), IntegerField()),
+            'expense_total': _per_trip(Expense.objects, Sum('amount'), DecimalField(max_digits=12, decimal_places=2)),
+            'open_task_count': _per_trip(open_tasks, Count('id'), IntegerField()),
+        }
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, columns=(), user=None):
+        # The counts and total come with the trips in one query; the user's open tasks take one more
+        fields = set(cls.Meta.fields) if fields is None else fields
+        queryset = super().setup_eager_loading(queryset, fields, columns)
+        queryset = queryset.annotate(**{name: value for name, value in cls.annotations().items() if name in fields})
+        if 'my_open_tasks' in fields:
+            open_tasks = Task.objects.exclude(status=Task.Status.DONE).filter(responsible__user=user).only('id', 'name', 'trip_id')
+            queryset = queryset.prefetch_related(Prefetch('tasks', queryset=open_tasks, to_attr='my_open_tasks'))
+        return queryset
+
+
+class ParticipantCreateSerializer(SparseModelSerializer):
     username_to_add = serializers.CharField(write_only=True)
     participant_id = serializers.IntegerField(source='id', read_only=True)
     user_id      = serializers.PrimaryKeyRelatedField(source='user', read_only=True)
@@ -85,4 +222,9 @@ class ParticipantCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = validated_data.pop('username_to_add')
         trip = validated_data.pop('trip')
-        return Participant.objects.create(user=user, trip=trip)
\ No newline at end of file
+        return Participant.objects.create(user=user, trip=trip)
+
+class DestinationResolutionSerializer(SparseModelSerializer):
+    class Meta:
+        model = DestinationResolution
+        fields = ['country_code', 'lat', 'lon']
@@ -0,0 +1,221 @@
+# KJObackend/singleflight.py
+#
+# Request coalescing for the upstream lookups. Concurrent callers asking for the
+# same key wait for one in-flight computation instead of each calling upstream:
+# threads of a worker share it in memory, and workers on the same host share it
+# through a lock file in SINGLE_FLIGHT_LOCK_DIR (and a result file next to it, written
+# only when another worker is waiting); files of keys that haven't been used for
+# SINGLE_FLIGHT_FILE_TTL seconds are swept away. A caller waits at most
+# SINGLE_FLIGHT_MAX_WAIT seconds and then computes the value itself. Coroutines on
+# one event loop share a task (acoalesced).
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import stat
+import threading
+import time
+from pathlib import Path
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+
+from . import metrics
+from .caching import CacheStats
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within the process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+coalescing_stats = CacheStats('single_flight', outcomes=('leader', 'coalesced_thread', 'coalesced_process', 'coalesced_task', 'gave_up'))
+
+metrics.register_collector(lambda: [(
+    'coalesced_calls_total', 'counter', "Upstream lookups that led a computation or joined one in flight",
+    [({'outcome': outcome}, count) for outcome, count in coalescing_stats.snapshot().items()],
+)])
+
+_lock = threading.Lock()
+_in_flight = {}
+_async_in_flight = WeakKeyDictionary()
+_last_sweep = 0.0
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _read_shared(path, written_after):
+    try:
+        shared = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+    return shared if shared['written_at'] >= written_after else None
+
+
+def _write_shared(path, value):
+    try:
+        payload = json.dumps({'value': value, 'written_at': time.time()})
+    except TypeError:
+        # Not JSON; the other workers will recompute it, normally from the cache we just filled
+        return
+    tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+    tmp.write_text(payload)
+    os.replace(tmp, path)
+
+
+def _sweep(lock_dir):
+    # At most once per SINGLE_FLIGHT_FILE_TTL per process: removes the files of keys not used since then.
+    # A lock file is only removed while nobody holds it; a worker that still opened the old one
+    # just doesn't coalesce with the next caller.
+    global _last_sweep
+    now = time.time()
+    with _lock:
+        if now - _last_sweep < settings.SINGLE_FLIGHT_FILE_TTL:
+            return
+        _last_sweep = now
+
+    cutoff = now - settings.SINGLE_FLIGHT_FILE_TTL
+    for path in Path(lock_dir).iterdir():
+        try:
+            if path.stat().st_mtime >= cutoff:
+                continue
+            if path.suffix == '.lock':
+                with open(path, 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    path.unlink()
+            else:
+                path.unlink()
+        except OSError:  # in use, or already gone
+            continue
+
+
+def _private_dir(lock_dir):
+    # Result files are trusted as computed values, so only use a directory nobody else can write to
+    path = Path(lock_dir)
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    info = path.stat()
+    if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+        logger.warning("Not coalescing across workers: %s is not private to this user", lock_dir)
+        return None
+    return path
+
+
+def _lock_within(lock_file, deadline):
+    # Polls for the lock until the deadline; False if the other worker still holds it
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+
+def _run_across_workers(key, func):
+    lock_dir = settings.SINGLE_FLIGHT_LOCK_DIR
+    if fcntl is None or not lock_dir:
+        return func()
+    lock_dir = _private_dir(lock_dir)
+    if lock_dir is None:
+        return func()
+
+    base = lock_dir / hashlib.sha1(key.encode()).hexdigest()
+    result_path = base.with_suffix('.json')
+    waiting_path = base.with_suffix('.waiting')
+    waiting_since = time.time()
+
+    with open(base.with_suffix('.lock'), 'a') as lock_file:
+        os.utime(lock_file.fileno())  # marks the key as used, for _sweep
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another worker is computing it: ask it to share the result, and wait for that
+            waiting_path.touch()
+            if not _lock_within(lock_file, time.monotonic() + settings.SINGLE_FLIGHT_MAX_WAIT):
+                coalescing_stats.incr('gave_up')
+                return func()
+            shared = _read_shared(result_path, waiting_since)
+            if shared is not None:
+                coalescing_stats.incr('coalesced_process')
+                return shared['value']
+
+        value = func()
+        if waiting_path.exists():
+            _write_shared(result_path, value)
+            waiting_path.unlink(missing_ok=True)
+    _sweep(lock_dir)
+    return value
+
+
+def single_flight(key, func):
+    with _lock:
+        call = _in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = _in_flight[key] = _Call()
+
+    if not leader:
+        if not call.done.wait(settings.SINGLE_FLIGHT_MAX_WAIT):
+            coalescing_stats.incr('gave_up')
+            return func()
+        coalescing_stats.incr('coalesced_thread')
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    coalescing_stats.incr('leader')
+    try:
+        call.value = _run_across_workers(key, func)
+        return call.value
+    except Exception as error:
+        call.error = error
+        raise
+    finally:
+        with _lock:
+            del _in_flight[key]
+        call.done.set()
+
+
+def _call_key(name, key, args, kwargs):
+    identity = key(*args, **kwargs) if key else [args, kwargs]
+    return f"{name}:{json.dumps(identity, default=str, sort_keys=True)}"
+
+
+def coalesced(name, key=None):
+    # Decorator; key(*args, **kwargs) picks what identifies a call (default: all arguments)
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return single_flight(_call_key(name, key, args, kwargs), lambda: func(*args, **kwargs))
+        return wrapper
+    return decorate
+
+
+def acoalesced(name, key=None):
+    # Async decorator: concurrent awaits with the same key on one event loop share a task
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            call_key = _call_key(name, key, args, kwargs)
+            in_flight = _async_in_flight.setdefault(asyncio.get_running_loop(), {})
+
+            task = in_flight.get(call_key)
+            if task is None:
+                coalescing_stats.incr('leader')
+                task = in_flight[call_key] = asyncio.ensure_future(func(*args, **kwargs))
+                task.add_done_callback(lambda _: in_flight.pop(call_key, None))
+            else:
+                coalescing_stats.incr('coalesced_task')
+            # One caller being cancelled must not cancel the others
+            return await asyncio.shield(task)
+        return wrapper
+    return decorate
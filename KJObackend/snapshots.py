@@ -0,0 +1,90 @@
+# KJObackend/snapshots.py
+#
+# External info is precomputed per trip in the background (when a trip is created,
+# when its destination or dates change, when a snapshot gets old, and by the
+# refresh_snapshots command), so ExternalInfoAPI never waits for the upstream APIs.
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import ratelimit
+from .external_info import build_external_info
+from .models import Trip, ExternalInfoSnapshot
+
+_executor = ThreadPoolExecutor(max_workers=settings.SNAPSHOT_WORKERS, thread_name_prefix='snapshot')
+_lock = threading.Lock()
+_queued = set()
+
+
+# Parts of the payload that can be carried over from the previous snapshot
+PAYLOAD_PARTS = ['events', 'weather_interpretation']
+
+
+def refresh_snapshot(trip, deadline=None):
+    payload = build_external_info(trip, deadline)
+
+    # Degraded mode: keep the last known value of whatever upstream failed this time
+    previous = ExternalInfoSnapshot.objects.filter(trip=trip).first()
+    if payload.get('missing') and previous is not None and previous.matches(trip):
+        stale = [part for part in PAYLOAD_PARTS if part in payload['missing'] and previous.payload.get(part)]
+        for part in stale:
+            payload[part] = previous.payload[part]
+        if stale:
+            payload['stale'] = stale
+    snapshot, _ = ExternalInfoSnapshot.objects.update_or_create(
+        trip=trip,
+        defaults={
+            'payload': payload,
+            'destination': trip.destination,
+            'start_date': trip.start_date,
+            'end_date': trip.end_date,
+            'computed_at': timezone.now(),
+        },
+    )
+    return snapshot
+
+
+def _refresh_in_background(trip_id):
+    try:
+        trip = Trip.objects.filter(pk=trip_id).first()
+        if trip is not None:
+            with ratelimit.priority(ratelimit.BACKGROUND):
+                refresh_snapshot(trip)
+    finally:
+        # Only now, so reads of the old snapshot meanwhile don't start a second refresh
+        with _lock:
+            _queued.discard(trip_id)
+        connections.close_all()
+
+
+def schedule_snapshot(trip_id):
+    # Runs after the current transaction commits; a trip already queued or being refreshed isn't queued again
+    def submit():
+        with _lock:
+            if trip_id in _queued:
+                return
+            _queued.add(trip_id)
+        _executor.submit(_refresh_in_background, trip_id)
+
+    transaction.on_commit(submit)
+
+
+def snapshot_response(trip):
+    snapshot = ExternalInfoSnapshot.objects.filter(trip=trip).first()
+
+    if snapshot is None or not snapshot.matches(trip):
+        schedule_snapshot(trip.id)
+        return {'events': [], 'status': 'pending'}
+
+    age = (timezone.now() - snapshot.computed_at).total_seconds()
+    if age > settings.SNAPSHOT_MAX_AGE:
+        schedule_snapshot(trip.id)
+
+    return {
+        **snapshot.payload,
+        'status': 'ready',
+        'snapshot_age': round(age),
+    }
@@ -0,0 +1,454 @@
+import base64
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from unittest import mock
+
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import breaker, http_client, ratelimit, singleflight
+from .breaker import CircuitBreaker, UpstreamUnavailable, breaker_for, breakers
+from .external_apis import get_coordinates, get_ticketmaster_events
+from .external_apis_async import aget_ticketmaster_events
+from .models import Trip, Participant, Event, TicketmasterDay
+from .ratelimit import BACKGROUND, INTERACTIVE, RateLimited, TokenBucket
+from .sample_data import sample_trip
+
+User = get_user_model()
+
+
+class QueryCountTests(TestCase):
+    # The trip endpoints run a fixed number of queries however many trips and nested rows there
+    # are; if one of these fails, check the prefetch plans in serializers.py
+
+    # The trips (with their owner), then one each for participants, events, expenses,
+    # the expenses' shared_between and tasks
+    FULL_QUERIES = 6
+    # ?view=summary: the annotated trips, then the user's open tasks
+    SUMMARY_QUERIES = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='traveller')
+        cls.friends = [User.objects.create(username=f"friend-{i}") for i in range(3)]
+        cls.trips = [sample_trip(cls.user, cls.friends, i) for i in range(5)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_trip_list(self):
+        with self.assertNumQueries(self.FULL_QUERIES):
+            response = self.client.get('/api/trips/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 5)
+
+    def test_trip_list_does_not_grow_with_trips(self):
+        for i in range(5, 25):
+            sample_trip(self.user, self.friends, i)
+        with self.assertNumQueries(self.FULL_QUERIES):
+            response = self.client.get('/api/trips/')
+        self.assertEqual(len(response.json()), 25)
+
+    def test_trip_summary_list(self):
+        with self.assertNumQueries(self.SUMMARY_QUERIES):
+            response = self.client.get('/api/trips/', {'view': 'summary'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 5)
+
+    def test_trip_detail(self):
+        with self.assertNumQueries(self.FULL_QUERIES):
+            response = self.client.get(f"/api/trips/{self.trips[0].id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['events']), 2)
+
+
+class KeysetPaginationTests(TestCase):
+    # Pages must cover every row exactly once, in order, however the sort keys tie
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='traveller')
+        # Three trips per start date, so pages break inside runs of equal dates
+        for i in range(11):
+            trip = Trip.objects.create(
+                owner=cls.user, name=f"Trip {i}", start_date=date(2030, 1, 1) + timedelta(days=i // 3), end_date=date(2030, 2, 1),
+            )
+            Participant.objects.create(user=cls.user, trip=trip)
+        cls.trip = trip
+        # Planned events on a few dates and unplanned ones (date NULL), which sort last
+        for i in range(13):
+            Event.objects.create(trip=trip, name=f"Event {i}", date=None if i % 4 == 0 else date(2030, 1, 1 + i % 3))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, params, key):
+        # Follows the next links to the end, then the previous links back to the start
+        pages = [self.client.get(url, params).json()]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).json())
+        forward = [row[key] for page in pages for row in page['results']]
+
+        backward_pages = [pages[-1]]
+        while backward_pages[-1]['previous']:
+            backward_pages.append(self.client.get(backward_pages[-1]['previous']).json())
+        backward = [row[key] for page in reversed(backward_pages) for row in page['results']]
+        return forward, backward, len(pages)
+
+    def test_trips_forward_and_back(self):
+        forward, backward, pages = self.walk('/api/trips/', {'page_size': 4, 'fields': 'trip_id,start_date'}, 'trip_id')
+        expected = list(Trip.objects.order_by('start_date', 'id').values_list('id', flat=True))
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+        self.assertEqual(pages, 3)
+
+    def test_events_with_null_dates(self):
+        forward, backward, pages = self.walk(f"/api/trips/{self.trip.id}/events/", {'page_size': 3}, 'event_id')
+        events = Event.objects.filter(trip=self.trip)
+        expected = [*events.filter(date__isnull=False).order_by('date', 'id'), *events.filter(date__isnull=True).order_by('id')]
+        self.assertEqual(forward, [event.id for event in expected])
+        self.assertEqual(backward, forward)
+        self.assertEqual(pages, 5)
+
+    def test_first_and_last_page_links(self):
+        first = self.client.get('/api/trips/', {'page_size': 20}).json()
+        self.assertEqual(len(first['results']), 11)
+        self.assertIsNone(first['next'])
+        self.assertIsNone(first['previous'])
+
+    def test_plain_list_without_page_params(self):
+        response = self.client.get('/api/trips/', {'fields': 'trip_id'})
+        self.assertEqual(len(response.json()), 11)
+
+    @override_settings(API_PAGE_SIZE=5, API_MAX_PAGE_SIZE=8)
+    def test_page_size_is_clamped(self):
+        for size, expected in (('1000', 8), ('0', 1), ('-3', 1), ('abc', 5)):
+            with self.subTest(page_size=size):
+                response = self.client.get('/api/trips/', {'page_size': size, 'fields': 'trip_id'})
+                self.assertEqual(len(response.json()['results']), expected)
+
+    def test_invalid_cursors(self):
+        def encode(data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+        cursors = [
+            'ab', '!!!', encode(None), encode(['2030-01-01', 1]),
+            encode({'d': 'next', 'v': ['not-a-date', 1]}),
+            encode({'d': 'next', 'v': ['2030-01-01', 'x']}),
+            encode({'d': 'next', 'v': ['2030-01-01']}),
+            encode({'d': 'next', 'v': 'ab'}),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/api/trips/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+def upstream_response(status, body=b'{}'):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    return response
+
+
+# No retries, rate limits or coalescing across processes, so each test sees exactly the upstream answers it sets up
+@override_settings(HTTP_MAX_RETRIES=0, RATE_LIMITS={}, SINGLE_FLIGHT_LOCK_DIR='')
+class TicketmasterFallbackTests(TestCase):
+    start = date(2030, 6, 1)
+    end = date(2030, 6, 2)
+    concert = {'id': 'e1', 'name': 'Concert', 'date': '2030-06-01', 'url': None, 'category': 'Music'}
+
+    def setUp(self):
+        breakers.clear()
+
+    def store_expired_events(self):
+        TicketmasterDay.objects.create(
+            city_key='oslo', country_code='NO', day=self.start, events=[self.concert],
+            fetched_at=timezone.now() - timedelta(days=2),
+        )
+
+    def test_server_error_serves_expired_events(self):
+        self.store_expired_events()
+        with mock.patch.object(requests.Session, 'get', return_value=upstream_response(503)):
+            events = get_ticketmaster_events('Oslo', 'NO', self.start, self.end)
+        self.assertEqual([event['name'] for event in events], ['Concert'])
+        # Nothing from the failed call is stored over the old events
+        self.assertEqual(TicketmasterDay.objects.get(day=self.start).events, [self.concert])
+
+    def test_server_error_without_stored_events_raises(self):
+        with mock.patch.object(requests.Session, 'get', return_value=upstream_response(503)):
+            with self.assertRaises(UpstreamUnavailable):
+                get_ticketmaster_events('Oslo', 'NO', self.start, self.end)
+        self.assertFalse(TicketmasterDay.objects.exists())
+
+    def test_async_server_error_serves_expired_events(self):
+        self.store_expired_events()
+        with mock.patch.object(httpx.AsyncClient, 'get', mock.AsyncMock(return_value=httpx.Response(503))):
+            events = async_to_sync(aget_ticketmaster_events)('Oslo', 'NO', self.start, self.end)
+        self.assertEqual([event['name'] for event in events], ['Concert'])
+
+
+class FakeClock:
+    # Stands in for the time module of the module under test
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@override_settings(
+    HTTP_MAX_RETRIES=0, RATE_LIMITS={}, SINGLE_FLIGHT_LOCK_DIR='',
+    BREAKER_WINDOW=10, BREAKER_MIN_CALLS=4, BREAKER_FAILURE_RATE=0.5, BREAKER_OPEN_SECONDS=30,
+)
+class CircuitBreakerTests(TestCase):
+    url = 'https://upstream.test/data'
+
+    def setUp(self):
+        breakers.clear()
+        self.clock = FakeClock()
+        patcher = mock.patch.object(breaker, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(self, status):
+        with mock.patch.object(requests.Session, 'get', return_value=upstream_response(status)) as get:
+            try:
+                http_client.get(self.url, upstream='upstream')
+            except UpstreamUnavailable:
+                pass
+        return get.call_count
+
+    def open_breaker(self):
+        for _ in range(4):
+            self.call(503)
+        self.assertEqual(breaker_for('upstream').state, CircuitBreaker.OPEN)
+
+    def test_open_half_open_closed(self):
+        self.open_breaker()
+        # Open: calls fail fast without reaching the upstream
+        self.assertEqual(self.call(200), 0)
+
+        self.clock.now += 31
+        # The probe goes out, succeeds and closes the breaker
+        self.assertEqual(self.call(200), 1)
+        self.assertEqual(breaker_for('upstream').state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.call(200), 1)
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        self.clock.now += 31
+        self.assertEqual(self.call(503), 1)
+        self.assertEqual(breaker_for('upstream').state, CircuitBreaker.OPEN)
+        self.assertEqual(self.call(200), 0)
+
+    def test_only_one_probe_at_a_time(self):
+        self.open_breaker()
+        self.clock.now += 31
+        circuit = breaker_for('upstream')
+        with circuit.call():
+            self.assertEqual(circuit.state, CircuitBreaker.HALF_OPEN)
+            with self.assertRaises(UpstreamUnavailable):
+                circuit.check()
+        # Left without an outcome: counts as a failed probe
+        self.assertEqual(circuit.state, CircuitBreaker.OPEN)
+
+    def test_client_errors_count_as_failures(self):
+        with mock.patch.object(requests.Session, 'get', return_value=upstream_response(401)):
+            for _ in range(4):
+                with self.assertRaises(UpstreamUnavailable):
+                    get_coordinates('Oslo', 'NO')
+        self.assertEqual(breaker_for('openweather').state, CircuitBreaker.OPEN)
+
+
+class MetricsAccessTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('user', password='x')
+        self.admin = User.objects.create_user('admin', password='x', is_staff=True)
+
+    def test_admin_only_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    @override_settings(METRICS_TOKEN='scrape')
+    def test_token_required_when_set(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+@override_settings(RATE_LIMIT_QUEUE=10, RATE_LIMIT_MAX_WAIT=10)
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(ratelimit, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bucket = TokenBucket('upstream', per_minute=60, burst=2)
+
+    def tick(self, seconds):
+        # Moves the clock on and wakes the callers waiting for it
+        with self.bucket._cond:
+            self.clock.now += seconds
+            self.bucket._cond.notify_all()
+
+    def wait_until(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("timed out")
+
+    @override_settings(RATE_LIMIT_MAX_WAIT=0.5)
+    def test_refills_at_the_configured_rate(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+        # Empty: the next token is a second away, longer than the caller may wait
+        with self.assertRaises(RateLimited):
+            self.bucket.acquire()
+        self.tick(1)
+        self.bucket.acquire()
+        self.tick(10)  # refills up to the burst, not beyond
+        self.bucket.acquire()
+        self.bucket.acquire()
+        with self.assertRaises(RateLimited):
+            self.bucket.acquire()
+        self.assertEqual(self.bucket.granted, 5)
+        self.assertEqual(self.bucket.rejected, 2)
+
+    @override_settings(RATE_LIMIT_QUEUE=0)
+    def test_full_queue_rejects(self):
+        with self.assertRaises(RateLimited):
+            self.bucket.acquire()
+
+    def test_interactive_callers_go_first(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+        granted = []
+
+        def caller(level, name):
+            self.bucket.acquire(level)
+            granted.append(name)
+
+        background = threading.Thread(target=caller, args=(BACKGROUND, 'background'))
+        background.start()
+        self.wait_until(lambda: self.bucket.snapshot()['queued']['background'] == 1)
+        interactive = threading.Thread(target=caller, args=(INTERACTIVE, 'interactive'))
+        interactive.start()
+        self.wait_until(lambda: self.bucket.snapshot()['queued']['interactive'] == 1)
+
+        # One token: it goes to the interactive caller, although the background one came first
+        self.tick(1)
+        interactive.join(5)
+        self.assertEqual(granted, ['interactive'])
+        self.tick(1)
+        background.join(5)
+        self.assertEqual(granted, ['interactive', 'background'])
+        self.assertEqual(self.bucket.snapshot()['queued'], {'interactive': 0, 'background': 0})
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.lock_dir = os.path.join(tempfile.mkdtemp(), 'singleflight')
+        override = override_settings(SINGLE_FLIGHT_LOCK_DIR=self.lock_dir, SINGLE_FLIGHT_MAX_WAIT=5)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def in_thread(self, func):
+        thread = threading.Thread(target=func)
+        thread.start()
+        self.addCleanup(thread.join)
+        return thread
+
+    def test_threads_share_one_call(self):
+        calls, results = [], []
+        ready = threading.Barrier(5)
+
+        def lookup():
+            calls.append(1)
+            time.sleep(0.2)  # long enough for the other threads to join it
+            return {'temp': 21}
+
+        def caller():
+            ready.wait(5)
+            results.append(singleflight.single_flight('k', lookup))
+
+        threads = [self.in_thread(caller) for _ in range(5)]
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'temp': 21}] * 5)
+
+    # flock locks belong to the open file, so two callers of _run_across_workers in one
+    # process contend for the lock file just like two workers do
+
+    def test_workers_share_the_result(self):
+        started, release = threading.Event(), threading.Event()
+
+        def lookup():
+            started.set()
+            release.wait(5)
+            return {'temp': 21}
+
+        def release_once_waited_for():
+            while not any(name.endswith('.waiting') for name in os.listdir(self.lock_dir)):
+                time.sleep(0.01)
+            release.set()
+
+        leader = self.in_thread(lambda: singleflight._run_across_workers('k', lookup))
+        started.wait(5)
+        self.in_thread(release_once_waited_for)
+        self.assertEqual(singleflight._run_across_workers('k', lambda: self.fail("computed twice")), {'temp': 21})
+        leader.join()
+
+    def test_result_file_only_written_for_waiters(self):
+        self.assertEqual(singleflight._run_across_workers('k', lambda: 1), 1)
+        self.assertEqual([name for name in os.listdir(self.lock_dir) if name.endswith('.json')], [])
+
+    @override_settings(SINGLE_FLIGHT_MAX_WAIT=0.1)
+    def test_gives_up_on_a_stuck_worker(self):
+        started, release = threading.Event(), threading.Event()
+
+        def stuck():
+            started.set()
+            release.wait(5)
+
+        self.in_thread(lambda: singleflight._run_across_workers('k', stuck))
+        started.wait(5)
+        try:
+            self.assertEqual(singleflight._run_across_workers('k', lambda: 'own'), 'own')
+        finally:
+            release.set()
+
+    def test_lock_dir_is_private(self):
+        singleflight._run_across_workers('k', lambda: 1)
+        self.assertEqual(stat.S_IMODE(os.stat(self.lock_dir).st_mode), 0o700)
+
+    def test_shared_lock_dir_is_not_used(self):
+        os.mkdir(self.lock_dir, 0o777)
+        os.chmod(self.lock_dir, 0o777)
+        with self.assertLogs('KJObackend.singleflight', 'WARNING'):
+            self.assertEqual(singleflight._run_across_workers('k', lambda: 1), 1)
+        self.assertEqual(os.listdir(self.lock_dir), [])
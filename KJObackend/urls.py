@@ -12,6 +12,10 @@ from .api import (
     TaskDetailAPI,
     LoginView,
     ExternalInfoAPI,
+    ExternalInfoLiveAPI,
+    ExternalInfoStreamAPI,
+    DestinationResolveAPI,
+    StatsAPI,
 )
 
 urlpatterns = [
@@ -32,4 +36,8 @@ urlpatterns = [
 
     # External information API endpoint
     path('trips/<int:trip_id>/external_info/', ExternalInfoAPI.as_view(), name='external-info'),
+    path('trips/<int:trip_id>/external_info/live/', ExternalInfoLiveAPI.as_view(), name='external-info-live'),
+    path('trips/<int:trip_id>/external_info/stream/', ExternalInfoStreamAPI.as_view(), name='external-info-stream'),
+    path('destinations/resolve/', DestinationResolveAPI.as_view(), name='destinations-resolve'),
+    path('stats/', StatsAPI.as_view(), name='stats'),
 ]
\ No newline at end of file
@@ -14,6 +14,8 @@ load_dotenv()
 
 from pathlib import Path
 import os
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -52,6 +54,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'KJObackend.middleware.RequestIdMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -92,6 +95,11 @@ DATABASES = {
     }
 }
 
+# Only for the expense_trip_id index (Expense.Meta), whose include=['amount'] serves PostgreSQL's
+# index-only scans: SQLite builds it without the column and warns (models.W040) on every check.
+# It is the only covering index; remove this when that index changes or another include= is added
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -143,3 +151,151 @@ REST_FRAMEWORK = {
     ]
 }
 AUTH_USER_MODEL = 'auth.User'  
+
+# List endpoints are paginated when ?cursor= or ?page_size= is given: this many rows a page
+# by default, and at most API_MAX_PAGE_SIZE
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 50))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 500))
+
+# Cache
+# Per-process by default. Point CACHE_BACKEND/CACHE_LOCATION at a shared backend (e.g.
+# django.core.cache.backends.filebased.FileBasedCache and a directory) to share it between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# External APIs
+
+# Upstream hosts; point them at `manage.py standin_upstreams` to load-test without real quota
+# (OPENAI_BASE_URL then ends in /v1; empty means the official API)
+OPENWEATHER_BASE_URL = os.getenv('OPENWEATHER_BASE_URL', 'https://api.openweathermap.org').rstrip('/')
+TICKETMASTER_BASE_URL = os.getenv('TICKETMASTER_BASE_URL', 'https://app.ticketmaster.com').rstrip('/')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
+# Upstream HTTP: connect/read timeouts in seconds, connections kept alive per host, and
+# retries (with jittered exponential backoff) on connection errors, 429 and 5xx
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 8))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', 0.25))
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', 4))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 20))
+# Answer LLM prompts locally (KJObackend/llm_stub.py) instead of calling OpenAI, e.g. for tests;
+# OPENAI_STUB_LATENCY seconds are added per completion
+OPENAI_STUB = os.getenv('OPENAI_STUB', '').lower() in ('1', 'true', 'yes')
+OPENAI_STUB_LATENCY = float(os.getenv('OPENAI_STUB_LATENCY', 0))
+# Unknown destinations are sent to the LLM this many at a time when resolving in bulk
+COUNTRY_CODE_BATCH_SIZE = int(os.getenv('COUNTRY_CODE_BATCH_SIZE', 50))
+# POST /api/destinations/resolve/ looks up at most this many new destinations while the client
+# waits (geocoding shares the OpenWeather rate limit); the others are resolved in the background
+DESTINATION_RESOLVE_INLINE = int(os.getenv('DESTINATION_RESOLVE_INLINE', 10))
+# Most connections the async client (ASGI views) opens at once per worker
+HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv('HTTP_ASYNC_MAX_CONNECTIONS', 100))
+
+# Token-bucket rate limits per upstream, in calls per minute (0 disables one), shared by the
+# workers on this host through state files in RATE_LIMIT_DIR; up to RATE_LIMIT_BURST calls may
+# go out back to back. At most RATE_LIMIT_QUEUE callers wait for a bucket, for at most
+# RATE_LIMIT_MAX_WAIT seconds, before failing fast (interactive requests are served before background jobs)
+RATE_LIMITS = {
+    'openweather': int(os.getenv('RATE_LIMIT_OPENWEATHER', 60)),
+    'ticketmaster': int(os.getenv('RATE_LIMIT_TICKETMASTER', 240)),
+    'openai': int(os.getenv('RATE_LIMIT_OPENAI', 500)),
+}
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 5))
+RATE_LIMIT_QUEUE = int(os.getenv('RATE_LIMIT_QUEUE', 200))
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', 10))
+RATE_LIMIT_DIR = os.getenv('RATE_LIMIT_DIR', os.path.join(tempfile.gettempdir(), 'travelplanner-ratelimit'))
+
+# Circuit breakers per upstream: open when at least BREAKER_FAILURE_RATE of the last BREAKER_WINDOW
+# calls (and at least BREAKER_MIN_CALLS) failed or took longer than BREAKER_SLOW_CALL_MS, then fail
+# fast for BREAKER_OPEN_SECONDS before letting a probe call through
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', 20))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 5))
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_SLOW_CALL_MS = float(os.getenv('BREAKER_SLOW_CALL_MS', 5000))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', 30))
+
+# Seconds ExternalInfoAPI waits for its upstream calls before answering with what it has
+EXTERNAL_INFO_DEADLINE = float(os.getenv('EXTERNAL_INFO_DEADLINE', 20))
+
+# Daily forecasts are stored per grid cell of this many degrees (0.1 is roughly 11 km) and day, and
+# refetched after WEATHER_DAY_TTL seconds; the forecast API covers today and WEATHER_FORECAST_DAYS more days.
+# For WEATHER_DAY_STALE seconds after that they are still served at once while the cell is refetched in the background.
+WEATHER_CACHE_GRID = float(os.getenv('WEATHER_CACHE_GRID', 0.1))
+WEATHER_DAY_TTL = int(os.getenv('WEATHER_DAY_TTL', 3 * 3600))
+WEATHER_DAY_STALE = int(os.getenv('WEATHER_DAY_STALE', 6 * 3600))
+WEATHER_FORECAST_DAYS = int(os.getenv('WEATHER_FORECAST_DAYS', 5))
+
+# LLM weather summaries are stored and reused for forecasts within this many degrees of each other
+WEATHER_SUMMARY_TEMP_STEP = float(os.getenv('WEATHER_SUMMARY_TEMP_STEP', 1))
+# Most summaries kept; the least recently used ones are evicted beyond this
+WEATHER_SUMMARY_CACHE_SIZE = int(os.getenv('WEATHER_SUMMARY_CACHE_SIZE', 5000))
+
+# Ticketmaster results are read this many per page, for at most TICKETMASTER_MAX_PAGES pages and
+# TICKETMASTER_MAX_EVENTS events per search; at most TICKETMASTER_MAX_EVENTS_PER_DAY are kept a day
+TICKETMASTER_PAGE_SIZE = int(os.getenv('TICKETMASTER_PAGE_SIZE', 100))
+TICKETMASTER_MAX_PAGES = int(os.getenv('TICKETMASTER_MAX_PAGES', 5))
+TICKETMASTER_MAX_EVENTS = int(os.getenv('TICKETMASTER_MAX_EVENTS', 500))
+TICKETMASTER_MAX_EVENTS_PER_DAY = int(os.getenv('TICKETMASTER_MAX_EVENTS_PER_DAY', 50))
+# Seconds the Ticketmaster events stored for a (city, country, day) are reused before being fetched again
+TICKETMASTER_DAY_TTL = int(os.getenv('TICKETMASTER_DAY_TTL', 6 * 3600))
+
+# Logs are JSON lines on stdout, written by a background thread from a queue of at most
+# LOG_QUEUE_SIZE records (more are dropped). Payloads larger than LOG_PAYLOAD_MAX_BYTES are
+# logged in only LOG_PAYLOAD_SAMPLE_RATE of the records, and replaced by their size otherwise.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_PAYLOAD_MAX_BYTES = int(os.getenv('LOG_PAYLOAD_MAX_BYTES', 2048))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 0.01))
+# 'queue' for the JSON lines, 'null' to discard the logs; manage.py test discards them by default
+# so they don't bury the test output
+LOG_HANDLER = os.getenv('LOG_HANDLER', 'null' if sys.argv[1:2] == ['test'] else 'queue')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'KJObackend.logs.RequestIdFilter'},
+    },
+    'handlers': {
+        'queue': {'class': 'KJObackend.logs.QueueLogHandler', 'filters': ['request_id']},
+        'null': {'class': 'logging.NullHandler'},
+    },
+    'root': {'handlers': [LOG_HANDLER], 'level': 'WARNING'},
+    'loggers': {
+        'KJObackend': {'handlers': [LOG_HANDLER], 'level': LOG_LEVEL, 'propagate': False},
+        'django': {'handlers': [LOG_HANDLER], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# /metrics requires this bearer token when set, and an admin user's API token otherwise
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Workers on this host coalesce identical upstream lookups through lock files here (empty disables it).
+# It is created with mode 0700 and skipped unless it is private to the user running the workers
+SINGLE_FLIGHT_LOCK_DIR = os.getenv('SINGLE_FLIGHT_LOCK_DIR', str(BASE_DIR / '.singleflight'))
+# Lock and result files of keys nobody asked for in this many seconds are removed from it
+SINGLE_FLIGHT_FILE_TTL = int(os.getenv('SINGLE_FLIGHT_FILE_TTL', 300))
+# A caller waits this long for a lookup in flight elsewhere before doing it itself
+SINGLE_FLIGHT_MAX_WAIT = float(os.getenv('SINGLE_FLIGHT_MAX_WAIT', EXTERNAL_INFO_DEADLINE))
+
+# External info is precomputed per trip by this many background threads per worker, and
+# recomputed once a snapshot is older than SNAPSHOT_MAX_AGE seconds
+SNAPSHOT_WORKERS = int(os.getenv('SNAPSHOT_WORKERS', 2))
+SNAPSHOT_MAX_AGE = int(os.getenv('SNAPSHOT_MAX_AGE', 1800))
+
+# prefetch_upcoming_trips: how far ahead to look, how many trips to refresh at once, seconds
+# allowed per trip, and upstream calls per minute it may spend
+PREFETCH_DAYS = int(os.getenv('PREFETCH_DAYS', 7))
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 4))
+PREFETCH_DEADLINE = float(os.getenv('PREFETCH_DEADLINE', 120))
+PREFETCH_RATE_BUDGETS = {
+    'openweather': int(os.getenv('PREFETCH_BUDGET_OPENWEATHER', 50)),
+    'ticketmaster': int(os.getenv('PREFETCH_BUDGET_TICKETMASTER', 200)),
+    'openai': int(os.getenv('PREFETCH_BUDGET_OPENAI', 60)),
+}
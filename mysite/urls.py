@@ -17,7 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from KJObackend.api import MetricsAPI
+
 urlpatterns = [
+    path("metrics", MetricsAPI.as_view(), name="metrics"),
     path("api/", include("KJObackend.urls")),
     path("admin/", admin.site.urls),
 ]
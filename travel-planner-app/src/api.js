@@ -20,4 +20,37 @@ export async function api(path, {method = "GET", body = null} = {}) {
   const text = await res.text();
   return text ? JSON.parse(text) : null; //to handle deletions
 }
+
+// Reads a server-sent-events endpoint, calling onEvent(name, data) for each event.
+// (EventSource can't send the Authorization header, so this uses fetch.)
+export async function apiStream(path, onEvent, {signal} = {}) {
+  const headers = {};
+  const token = getToken();
+  if (token) headers["Authorization"] = `Token ${token}`;
+
+  const res = await fetch(`${base}${path}`, {headers, signal});
+  if (!res.ok) throw new Error(await res.text());
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;) {
+    const {done, value} = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, {stream: true});
+
+    let end;
+    while ((end = buffer.indexOf("\n\n")) !== -1) {
+      const message = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      let name = "message";
+      let data = "";
+      for (const line of message.split("\n")) {
+        if (line.startsWith("event: ")) name = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      onEvent(name, data ? JSON.parse(data) : null);
+    }
+  }
+}
 //ole
\ No newline at end of file
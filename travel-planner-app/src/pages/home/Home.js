@@ -25,7 +25,7 @@ export default function Home() {
   useEffect(() => {
     const fetchTrips = async () => {
       try {
-        const data = await api("/trips/");
+        const data = await api("/trips/?view=summary");
         setTrips(data);
       } catch (e) {
         if (e.message?.includes("401")) {
@@ -38,21 +38,15 @@ export default function Home() {
 
   const future = trips.filter(t => isFuture(t.start_date));
   const past = trips.filter(t => !isFuture(t.end_date));
-  const myUserId = Number(localStorage.getItem("user_id"));
 
   const myTasks = [];
 
   for (const trip of future) {
-    const participant = trip.participants.find(p => p.user_id === myUserId);
-    const myId = participant.participant_id;
-
-    for (const task of trip.tasks) {
-      if (task.responsible_id === myId && task.status !== 2) {
-        myTasks.push({
-          ...task,
-          tripName: trip.name
-        });
-      }
+    for (const task of trip.my_open_tasks) {
+      myTasks.push({
+        ...task,
+        tripName: trip.name
+      });
     }
   }
 
@@ -62,7 +56,7 @@ export default function Home() {
       method: "POST",
       body: {name: vacName, start_date: startDate, end_date: endDate, destination: destination, description: description}
     });
-    setTrips(await api("/trips/"));
+    setTrips(await api("/trips/?view=summary"));
     
     setVacName("");
     setDestination("");
@@ -1,7 +1,7 @@
 import React from 'react';
 import {useParams, useNavigate} from "react-router-dom";
 import {useEffect, useState} from "react";
-import {api} from "../../api";
+import {api, apiStream} from "../../api";
 import styles from "./Vacation.module.css";
 
 export default function VacationOverview() {
@@ -53,18 +53,28 @@ export default function VacationOverview() {
   useEffect(() => {
     if (!trip) return;
 
+    const controller = new AbortController();
     const fetchExternalInfo = async () => {
       try {
         const d = await api(`/trips/${tripId}/external_info/`);
         setExternalEvents(d.events || []);
         setWeatherSummary(d.weather_interpretation?.Summary || '');
-      } catch {
+        if (d.status !== 'pending') return;
+
+        // Not precomputed yet: stream the sections in as they are ready
+        await apiStream(`/trips/${tripId}/external_info/stream/`, (name, data) => {
+          if (name === 'events') setExternalEvents(data || []);
+          else if (name === 'summary') setWeatherSummary(data?.Summary || '');
+        }, {signal: controller.signal});
+      } catch (e) {
+        if (e.name === 'AbortError') return;
         setExternalEvents([]);
         setWeatherSummary('');
       }
     };
 
     fetchExternalInfo();
+    return () => controller.abort();
   }, [trip, tripId]);
 
   const handleAddParticipantSubmit = async (e) => {